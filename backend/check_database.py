@@ -4,11 +4,11 @@ Quick database checker - see what's in your database
 """
 import sys
 import os
-import json
+from sqlalchemy import text
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from src.models.user import db, User, KeystrokeData, MLModel
+from src.models.user import db, decode_json, decode_keystroke_features
 from src.main import app
 
 with app.app_context():
@@ -16,10 +16,35 @@ with app.app_context():
     print("DATABASE CHECK")
     print("=" * 70)
 
-    # Check users
-    total_users = User.query.count()
-    dsl_users = User.query.filter(User.email.like('%@dsl.dataset')).count()
-    forensic_users = User.query.filter(User.email.like('%@forensiclab.bh')).count()
+    # Plain scalar counts go straight through the DB-API cursor
+    # (no SQLAlchemy compilation or Row processing needed)
+    conn = db.engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        try:
+            # Users: single table scan; the leading-wildcard LIKEs can't use an index
+            cur.execute(
+                "SELECT COUNT(*), "
+                "COALESCE(SUM(CASE WHEN email LIKE '%@dsl.dataset' THEN 1 ELSE 0 END), 0), "
+                "COALESCE(SUM(CASE WHEN email LIKE '%@forensiclab.bh' THEN 1 ELSE 0 END), 0) "
+                "FROM \"user\""
+            )
+            total_users, dsl_users, forensic_users = cur.fetchone()
+
+            cur.execute(
+                "SELECT COUNT(*), "
+                "COALESCE(SUM(CASE WHEN data_split = 'train' THEN 1 ELSE 0 END), 0), "
+                "COALESCE(SUM(CASE WHEN data_split = 'test' THEN 1 ELSE 0 END), 0) "
+                "FROM keystroke_data"
+            )
+            total_samples, train_samples, test_samples = cur.fetchone()
+
+            cur.execute("SELECT COUNT(*) FROM ml_model WHERE is_active = 1")
+            (total_models,) = cur.fetchone()
+        finally:
+            cur.close()
+    finally:
+        conn.close()
 
     print(f"\nUSERS:")
     print(f"  Total: {total_users}")
@@ -33,10 +58,6 @@ with app.app_context():
         print(f"\n  ✅ Found {dsl_users} DSL users")
 
     # Check keystroke data
-    total_samples = KeystrokeData.query.count()
-    train_samples = KeystrokeData.query.filter_by(data_split='train').count()
-    test_samples = KeystrokeData.query.filter_by(data_split='test').count()
-
     print(f"\nKEYSTROKE DATA:")
     print(f"  Total samples: {total_samples}")
     print(f"  Train split: {train_samples}")
@@ -47,10 +68,12 @@ with app.app_context():
     else:
         print(f"\n  ❌ Wrong sample count (expected 20,400, got {total_samples})")
 
-    # Check a sample keystroke data format
-    sample = KeystrokeData.query.first()
-    if sample:
-        features = json.loads(sample.keystroke_features)
+    # Check a sample keystroke data format (only the features column of one row)
+    sample_features = db.session.execute(text(
+        "SELECT keystroke_features FROM keystroke_data LIMIT 1"
+    )).scalar()
+    if sample_features:
+        features = decode_keystroke_features(sample_features)
         print(f"\nSAMPLE KEYSTROKE DATA FORMAT:")
         print(f"  Type: {type(features)}")
 
@@ -63,13 +86,15 @@ with app.app_context():
             print("  👉 You need to re-import with fixed code!")
 
     # Check models
-    total_models = MLModel.query.filter_by(is_active=True).count()
     print(f"\nTRAINED MODELS:")
     print(f"  Active models: {total_models}")
 
+    metadata = {}
     if total_models > 0:
-        model = MLModel.query.filter_by(is_active=True).first()
-        metadata = json.loads(model.training_metadata) if model.training_metadata else {}
+        meta_json = db.session.execute(text(
+            "SELECT training_metadata FROM ml_model WHERE is_active = 1 LIMIT 1"
+        )).scalar()
+        metadata = decode_json(meta_json)
 
         print(f"\nSAMPLE MODEL METADATA:")
         print(f"  Algorithm: {metadata.get('algorithm', 'Unknown')}")
@@ -10,9 +10,10 @@ Output: CSV file with per-user performance metrics for all 5 ML algorithms
 
 import sys
 import os
-import json
 import csv
 from datetime import datetime
+import numpy as np
+from sqlalchemy import and_, func, select
 
 # Fix encoding for Windows console
 if sys.platform == 'win32':
@@ -23,21 +24,40 @@ if sys.platform == 'win32':
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 from database import SessionLocal
-from models.user import User, MLModel, KeystrokeData
-
-
-def extract_model_comparison_metrics(metadata_json):
+from models.user import User, MLModel, KeystrokeData, decode_json
+
+# 1 MB write buffer so CSV rows are flushed to disk in a few large writes
+CSV_BUFFER_SIZE = 1 << 20
+
+# Column order of the per-user CSV (rows are written as tuples in this order)
+CSV_FIELDNAMES = [
+    'User ID', 'User Name', 'Email', 'Department',
+    'Total Samples', 'Training Samples', 'Testing Samples',
+    'Algorithm',
+    'Accuracy (%)', 'Precision (%)', 'Recall (%)', 'F1-Score (%)',
+    'FAR (%)', 'FRR (%)', 'EER (%)',
+    'Selected Model', 'Model Version', 'Training Date'
+]
+
+# Column order of the summary CSV
+SUMMARY_FIELDNAMES = [
+    'Algorithm', 'Users Count',
+    'Avg Accuracy (%)', 'Avg Precision (%)', 'Avg Recall (%)', 'Avg F1-Score (%)',
+    'Avg FAR (%)', 'Avg FRR (%)', 'Avg EER (%)'
+]
+
+
+def extract_model_comparison_metrics(metadata):
     """
     Extract performance metrics for all 5 algorithms from training metadata.
 
     Args:
-        metadata_json: JSON string from MLModel.training_metadata
+        metadata: Parsed MLModel.training_metadata dictionary
 
     Returns:
         Dictionary with metrics for each algorithm
     """
     try:
-        metadata = json.loads(metadata_json)
         model_comparisons = metadata.get('model_comparisons', [])
 
         metrics = {}
@@ -55,31 +75,37 @@ def extract_model_comparison_metrics(metadata_json):
             }
 
         return metrics
-    except (json.JSONDecodeError, AttributeError, KeyError) as e:
+    except (AttributeError, KeyError) as e:
         print(f"Error parsing metadata: {e}")
         return {}
 
 
-def calculate_derived_metrics(metrics):
+def calculate_derived_metrics(metrics_list):
     """
     Calculate Precision, Recall, and F1-Score from FAR/FRR if not present.
 
+    Works on all (user, algorithm) rows at once using NumPy arrays.
+    Rows that already have a precision value are left unchanged.
+
     NOTE: Metrics are stored as percentages (0-100), not fractions (0-1).
 
     Args:
-        metrics: Dictionary with accuracy, far, frr, eer (all in percentages)
+        metrics_list: List of dictionaries with accuracy, far, frr, eer (all in percentages)
 
     Returns:
-        Updated metrics with precision, recall, f1_score (all in percentages)
+        The same list, updated with precision, recall, f1_score (all in percentages)
     """
-    # If already calculated, return as-is
-    if metrics.get('precision', 0.0) > 0:
-        return metrics
+    if not metrics_list:
+        return metrics_list
+
+    # Only rows without a stored precision need to be derived
+    stored_precision = np.array([m.get('precision', 0.0) for m in metrics_list], dtype=np.float64)
+    missing = ~(stored_precision > 0)
 
     # Convert from percentage to fraction for calculation
     # Metrics are stored as percentages (0-100), so divide by 100
-    far = metrics.get('far', 0.0) / 100.0
-    frr = metrics.get('frr', 0.0) / 100.0
+    far = np.array([m.get('far', 0.0) for m in metrics_list], dtype=np.float64) / 100.0
+    frr = np.array([m.get('frr', 0.0) for m in metrics_list], dtype=np.float64) / 100.0
 
     # Precision ≈ 1 - FAR (genuine predictions that are correct)
     # Recall ≈ 1 - FRR (genuine samples that are correctly identified)
@@ -87,17 +113,18 @@ def calculate_derived_metrics(metrics):
     recall = 1.0 - frr
 
     # F1-Score = 2 * (Precision * Recall) / (Precision + Recall)
-    if precision + recall > 0:
-        f1_score = 2 * (precision * recall) / (precision + recall)
-    else:
-        f1_score = 0.0
+    total = precision + recall
+    f1_score = np.zeros_like(total)
+    np.divide(2 * (precision * recall), total, out=f1_score, where=total > 0)
 
     # Convert back to percentages for storage
-    metrics['precision'] = precision * 100.0
-    metrics['recall'] = recall * 100.0
-    metrics['f1_score'] = f1_score * 100.0
+    for i in np.flatnonzero(missing):
+        metrics = metrics_list[i]
+        metrics['precision'] = float(precision[i] * 100.0)
+        metrics['recall'] = float(recall[i] * 100.0)
+        metrics['f1_score'] = float(f1_score[i] * 100.0)
 
-    return metrics
+    return metrics_list
 
 
 def export_thesis_metrics():
@@ -107,19 +134,56 @@ def export_thesis_metrics():
     db = SessionLocal()
 
     try:
-        # Get all users with trained models
-        users = db.query(User).all()
+        # Latest active model per user (ranked by creation date)
+        latest_model = select(
+            MLModel.user_id,
+            MLModel.id.label('model_id'),
+            func.row_number().over(
+                partition_by=MLModel.user_id,
+                order_by=MLModel.created_at.desc()
+            ).label('rn')
+        ).where(MLModel.is_active == True).subquery()
+
+        # Keystroke sample count per user
+        keystroke_counts = select(
+            KeystrokeData.user_id,
+            func.count(KeystrokeData.id).label('keystroke_count')
+        ).group_by(KeystrokeData.user_id).subquery()
+
+        # One streamed query for every user + latest model + sample count (no N+1).
+        # Only the columns used below are selected (e.g. no pickled model_data).
+        users = db.query(
+            User.id,
+            User.name,
+            User.email,
+            User.department,
+            MLModel.training_metadata,
+            MLModel.model_version,
+            MLModel.created_at,
+            func.coalesce(keystroke_counts.c.keystroke_count, 0)
+        ).outerjoin(
+            latest_model,
+            and_(latest_model.c.user_id == User.id, latest_model.c.rn == 1)
+        ).outerjoin(
+            MLModel, MLModel.id == latest_model.c.model_id
+        ).outerjoin(
+            keystroke_counts, keystroke_counts.c.user_id == User.id
+        ).order_by(User.id).execution_options(stream_results=True).yield_per(100)
+
+        total_users = db.query(func.count(User.id)).scalar()
 
         print(f"\n{'='*80}")
         print(f"BioAuthAI - ML Performance Metrics Export for Thesis")
         print(f"{'='*80}")
-        print(f"Total Users in Database: {len(users)}\n")
+        print(f"Total Users in Database: {total_users}\n")
 
         # Prepare CSV output
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_file = f"thesis_ml_metrics_{timestamp}.csv"
 
+        pending_rows = []  # (user info, algorithm, metrics, model version, training date)
         csv_rows = []
+        numeric_rows = []  # Unformatted metrics for the summary table
 
         # Algorithm names for consistent ordering (ALL 5 algorithms)
         algorithm_names = [
@@ -131,74 +195,56 @@ def export_thesis_metrics():
         ]
 
         # Process each user
-        for user in users:
-            # Get the most recent active model for this user
-            model = db.query(MLModel).filter(
-                MLModel.user_id == user.id,
-                MLModel.is_active == True
-            ).order_by(MLModel.created_at.desc()).first()
-
-            if not model or not model.training_metadata:
-                print(f"⚠️  User {user.id} ({user.name}): No trained model found - SKIPPING")
+        for (user_id, user_name, user_email, department,
+             training_metadata, model_version, created_at, keystroke_count) in users:
+            if not training_metadata:
+                print(f"⚠️  User {user_id} ({user_name}): No trained model found - SKIPPING")
                 continue
 
-            # Get keystroke data count
-            keystroke_count = db.query(KeystrokeData).filter(
-                KeystrokeData.user_id == user.id
-            ).count()
+            # Parse training metadata once and reuse it below
+            try:
+                metadata = decode_json(training_metadata)
+            except ValueError as e:
+                print(f"Error parsing metadata: {e}")
+                metadata = {}
 
             # Extract metrics for all algorithms
-            all_metrics = extract_model_comparison_metrics(model.training_metadata)
+            all_metrics = extract_model_comparison_metrics(metadata)
 
             if not all_metrics:
-                print(f"⚠️  User {user.id} ({user.name}): No metrics in model - SKIPPING")
+                print(f"⚠️  User {user_id} ({user_name}): No metrics in model - SKIPPING")
                 continue
 
             # Get metadata for additional info
-            try:
-                metadata = json.loads(model.training_metadata)
-                train_samples = metadata.get('train_samples', 0)
-                test_samples = metadata.get('test_samples', 0)
-                selected_algorithm = metadata.get('algorithm', 'Unknown')
-            except:
-                train_samples = 0
-                test_samples = 0
-                selected_algorithm = 'Unknown'
-
-            print(f"✓ User {user.id} ({user.name}):")
+            train_samples = metadata.get('train_samples', 0)
+            test_samples = metadata.get('test_samples', 0)
+            selected_algorithm = metadata.get('algorithm', 'Unknown')
+
+            print(f"✓ User {user_id} ({user_name}):")
             print(f"  - Total Keystroke Samples: {keystroke_count}")
             print(f"  - Training Samples: {train_samples}")
             print(f"  - Testing Samples: {test_samples}")
             print(f"  - Selected Model: {selected_algorithm}")
-            print(f"  - Model Version: {model.model_version}")
-
-            # Create rows for each algorithm
+            print(f"  - Model Version: {model_version}")
+
+            # Same for every algorithm row of this user
+            training_date = created_at.strftime("%Y-%m-%d %H:%M:%S")
+
+            user_info = (
+                user_id,
+                user_name,
+                user_email,
+                department or 'N/A',
+                keystroke_count,
+                train_samples,
+                test_samples
+            )
+
+            # Collect rows for each algorithm (derived metrics are filled in below)
             for algo_name in algorithm_names:
                 if algo_name in all_metrics:
-                    metrics = calculate_derived_metrics(all_metrics[algo_name])
-
-                    row = {
-                        'User ID': user.id,
-                        'User Name': user.name,
-                        'Email': user.email,
-                        'Department': user.department or 'N/A',
-                        'Total Samples': keystroke_count,
-                        'Training Samples': train_samples,
-                        'Testing Samples': test_samples,
-                        'Algorithm': algo_name,
-                        'Accuracy (%)': f"{metrics['accuracy']:.2f}",
-                        'Precision (%)': f"{metrics['precision']:.2f}",
-                        'Recall (%)': f"{metrics['recall']:.2f}",
-                        'F1-Score (%)': f"{metrics['f1_score']:.2f}",
-                        'FAR (%)': f"{metrics['far']:.2f}",
-                        'FRR (%)': f"{metrics['frr']:.2f}",
-                        'EER (%)': f"{metrics['eer']:.2f}",
-                        'Selected Model': 'Yes' if metrics['selected'] else 'No',
-                        'Model Version': model.model_version,
-                        'Training Date': model.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                    }
-
-                    csv_rows.append(row)
+                    metrics = all_metrics[algo_name]
+                    pending_rows.append((user_info, algo_name, metrics, model_version, training_date))
 
                     print(f"    {algo_name:25s} - Acc: {metrics['accuracy']:5.2f}% | "
                           f"FAR: {metrics['far']:5.2f}% | FRR: {metrics['frr']:5.2f}% | "
@@ -207,20 +253,53 @@ def export_thesis_metrics():
 
             print()
 
+        # Precision / Recall / F1 for every (user, algorithm) pair in one batch
+        calculate_derived_metrics([metrics for _, _, metrics, _, _ in pending_rows])
+
+        for user_info, algo_name, metrics, model_version, training_date in pending_rows:
+            # Bind metric values to locals once per row
+            accuracy = metrics['accuracy']
+            precision = metrics['precision']
+            recall = metrics['recall']
+            f1_score = metrics['f1_score']
+            far = metrics['far']
+            frr = metrics['frr']
+            eer = metrics['eer']
+
+            # Same order as CSV_FIELDNAMES
+            row = (
+                *user_info,
+                algo_name,
+                f"{accuracy:.2f}",
+                f"{precision:.2f}",
+                f"{recall:.2f}",
+                f"{f1_score:.2f}",
+                f"{far:.2f}",
+                f"{frr:.2f}",
+                f"{eer:.2f}",
+                'Yes' if metrics['selected'] else 'No',
+                model_version,
+                training_date
+            )
+
+            csv_rows.append(row)
+            numeric_rows.append({
+                'algorithm': algo_name,
+                'accuracy': accuracy,
+                'precision': precision,
+                'recall': recall,
+                'f1_score': f1_score,
+                'far': far,
+                'frr': frr,
+                'eer': eer
+            })
+
         # Write CSV file
         if csv_rows:
-            fieldnames = [
-                'User ID', 'User Name', 'Email', 'Department',
-                'Total Samples', 'Training Samples', 'Testing Samples',
-                'Algorithm',
-                'Accuracy (%)', 'Precision (%)', 'Recall (%)', 'F1-Score (%)',
-                'FAR (%)', 'FRR (%)', 'EER (%)',
-                'Selected Model', 'Model Version', 'Training Date'
-            ]
-
-            with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
+            with open(output_file, 'w', newline='', encoding='utf-8',
+                      buffering=CSV_BUFFER_SIZE) as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(CSV_FIELDNAMES)
                 writer.writerows(csv_rows)
 
             print(f"{'='*80}")
@@ -232,7 +311,7 @@ def export_thesis_metrics():
             print(f"{'='*80}\n")
 
             # Also create a summary table for quick reference
-            create_summary_table(csv_rows, timestamp)
+            create_summary_table(numeric_rows, timestamp)
 
         else:
             print("⚠️  No users with trained models found. Please train models first.")
@@ -241,9 +320,13 @@ def export_thesis_metrics():
         db.close()
 
 
-def create_summary_table(csv_rows, timestamp):
+def create_summary_table(numeric_rows, timestamp):
     """
     Create a summary table with average metrics across all users per algorithm.
+
+    Args:
+        numeric_rows: Per-user metric dicts with raw (unformatted) float values
+        timestamp: Timestamp suffix shared with the per-user CSV
     """
     output_file = f"thesis_ml_summary_{timestamp}.csv"
 
@@ -255,56 +338,60 @@ def create_summary_table(csv_rows, timestamp):
         'GradientBoosting'
     ]
 
+    metric_columns = [
+        'accuracy', 'precision', 'recall', 'f1_score', 'far', 'frr', 'eer'
+    ]
+
+    # Group rows by algorithm in a single pass
+    buckets = {algo: [] for algo in algorithm_names}
+    for row in numeric_rows:
+        if row['algorithm'] in buckets:
+            buckets[row['algorithm']].append(row)
+
     summary_rows = []
 
     for algo in algorithm_names:
-        # Filter rows for this algorithm
-        algo_rows = [row for row in csv_rows if row['Algorithm'] == algo]
+        algo_rows = buckets[algo]
 
         if not algo_rows:
             continue
 
-        # Calculate averages
-        avg_accuracy = sum(float(row['Accuracy (%)']) for row in algo_rows) / len(algo_rows)
-        avg_precision = sum(float(row['Precision (%)']) for row in algo_rows) / len(algo_rows)
-        avg_recall = sum(float(row['Recall (%)']) for row in algo_rows) / len(algo_rows)
-        avg_f1 = sum(float(row['F1-Score (%)']) for row in algo_rows) / len(algo_rows)
-        avg_far = sum(float(row['FAR (%)']) for row in algo_rows) / len(algo_rows)
-        avg_frr = sum(float(row['FRR (%)']) for row in algo_rows) / len(algo_rows)
-        avg_eer = sum(float(row['EER (%)']) for row in algo_rows) / len(algo_rows)
-
-        summary_rows.append({
-            'Algorithm': algo,
-            'Users Count': len(algo_rows),
-            'Avg Accuracy (%)': f"{avg_accuracy:.2f}",
-            'Avg Precision (%)': f"{avg_precision:.2f}",
-            'Avg Recall (%)': f"{avg_recall:.2f}",
-            'Avg F1-Score (%)': f"{avg_f1:.2f}",
-            'Avg FAR (%)': f"{avg_far:.2f}",
-            'Avg FRR (%)': f"{avg_frr:.2f}",
-            'Avg EER (%)': f"{avg_eer:.2f}"
-        })
+        # Calculate averages (all metric columns in one vectorized pass)
+        metric_matrix = np.array(
+            [[row[col] for col in metric_columns] for row in algo_rows],
+            dtype=np.float64
+        )
+        (avg_accuracy, avg_precision, avg_recall, avg_f1,
+         avg_far, avg_frr, avg_eer) = metric_matrix.mean(axis=0)
+
+        # Same order as SUMMARY_FIELDNAMES
+        summary_rows.append((
+            algo,
+            len(algo_rows),
+            f"{avg_accuracy:.2f}",
+            f"{avg_precision:.2f}",
+            f"{avg_recall:.2f}",
+            f"{avg_f1:.2f}",
+            f"{avg_far:.2f}",
+            f"{avg_frr:.2f}",
+            f"{avg_eer:.2f}"
+        ))
 
     # Write summary CSV
     if summary_rows:
-        fieldnames = [
-            'Algorithm', 'Users Count',
-            'Avg Accuracy (%)', 'Avg Precision (%)', 'Avg Recall (%)', 'Avg F1-Score (%)',
-            'Avg FAR (%)', 'Avg FRR (%)', 'Avg EER (%)'
-        ]
-
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
+        with open(output_file, 'w', newline='', encoding='utf-8',
+                  buffering=CSV_BUFFER_SIZE) as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(SUMMARY_FIELDNAMES)
             writer.writerows(summary_rows)
 
         print(f"\n📊 Summary Table (Average Across All Users):")
         print(f"{'='*80}")
         print(f"{'Algorithm':<30} {'Accuracy':<10} {'FAR':<10} {'FRR':<10} {'EER':<10}")
         print(f"{'-'*80}")
-        for row in summary_rows:
-            print(f"{row['Algorithm']:<30} {row['Avg Accuracy (%)']:>8}% "
-                  f"{row['Avg FAR (%)']:>8}% {row['Avg FRR (%)']:>8}% {row['Avg EER (%)']:>8}%")
+        for algo, _, avg_accuracy, _, _, _, avg_far, avg_frr, avg_eer in summary_rows:
+            print(f"{algo:<30} {avg_accuracy:>8}% "
+                  f"{avg_far:>8}% {avg_frr:>8}% {avg_eer:>8}%")
         print(f"{'='*80}")
         print(f"Summary saved to: {output_file}\n")
 
@@ -8,8 +8,12 @@ for inclusion in academic thesis.
 
 import sys
 import csv
+import io
 import os
 
+# Write buffer for the generated .tex / .md files (one flush per file)
+OUTPUT_BUFFER_SIZE = 256 * 1024
+
 # Fix encoding for Windows console
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
@@ -38,24 +42,24 @@ def generate_latex_table():
         for row in reader:
             rows.append(row)
 
-    # Generate LaTeX table
-    latex_output = []
-    latex_output.append("\\begin{table}[h]")
-    latex_output.append("\\centering")
-    latex_output.append("\\caption{Machine Learning Model Performance Metrics - BioAuthAI System}")
-    latex_output.append("\\label{tab:ml_performance}")
-    latex_output.append("\\begin{tabular}{lcccccccc}")
-    latex_output.append("\\toprule")
-    latex_output.append("\\textbf{Model} & \\textbf{Accuracy} & \\textbf{Precision} & \\textbf{Recall} & "
-                       "\\textbf{F1-Score} & \\textbf{FAR} & \\textbf{FRR} & \\textbf{EER} & \\textbf{Users} \\\\")
-    latex_output.append("\\midrule")
+    # Generate LaTeX table into a single in-memory buffer
+    latex_output = io.StringIO()
+    latex_output.write("\\begin{table}[h]\n")
+    latex_output.write("\\centering\n")
+    latex_output.write("\\caption{Machine Learning Model Performance Metrics - BioAuthAI System}\n")
+    latex_output.write("\\label{tab:ml_performance}\n")
+    latex_output.write("\\begin{tabular}{lcccccccc}\n")
+    latex_output.write("\\toprule\n")
+    latex_output.write("\\textbf{Model} & \\textbf{Accuracy} & \\textbf{Precision} & \\textbf{Recall} & "
+                       "\\textbf{F1-Score} & \\textbf{FAR} & \\textbf{FRR} & \\textbf{EER} & \\textbf{Users} \\\\\n")
+    latex_output.write("\\midrule\n")
 
     for row in rows:
         algo = row['Algorithm']
         # Shorten algorithm names for better formatting
         algo_name = algo.replace('Classifier', '').replace('Forest', ' Forest')
 
-        latex_output.append(
+        latex_output.write(
             f"{algo_name:20s} & "
             f"{row['Avg Accuracy (%)']:>6s}\\% & "
             f"{row['Avg Precision (%)']:>6s}\\% & "
@@ -64,26 +68,24 @@ def generate_latex_table():
             f"{row['Avg FAR (%)']:>6s}\\% & "
             f"{row['Avg FRR (%)']:>6s}\\% & "
             f"{row['Avg EER (%)']:>6s}\\% & "
-            f"{row['Users Count']:>4s} \\\\"
+            f"{row['Users Count']:>4s} \\\\\n"
         )
 
-    latex_output.append("\\bottomrule")
-    latex_output.append("\\end{tabular}")
-    latex_output.append("\\end{table}")
+    latex_output.write("\\bottomrule\n")
+    latex_output.write("\\end{tabular}\n")
+    latex_output.write("\\end{table}\n")
 
     # Write to file
     output_file = summary_file.replace('.csv', '.tex')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(latex_output))
+    with open(output_file, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+        f.write(latex_output.getvalue())
 
     # Print to console
     print("="*80)
     print("LaTeX Table for Thesis")
     print("="*80)
     print()
-    for line in latex_output:
-        print(line)
-    print()
+    print(latex_output.getvalue())
     print("="*80)
     print(f"LaTeX table saved to: {output_file}")
     print("="*80)
@@ -96,16 +98,16 @@ def generate_latex_table():
 def generate_markdown_table(rows, summary_file):
     """Generate markdown table for documentation."""
 
-    markdown_output = []
-    markdown_output.append("# Machine Learning Model Performance Metrics")
-    markdown_output.append("")
-    markdown_output.append("## Summary Across All Users")
-    markdown_output.append("")
-    markdown_output.append("| Model | Accuracy | Precision | Recall | F1-Score | FAR | FRR | EER | Users |")
-    markdown_output.append("|-------|----------|-----------|--------|----------|-----|-----|-----|-------|")
+    markdown_output = io.StringIO()
+    markdown_output.write("# Machine Learning Model Performance Metrics\n")
+    markdown_output.write("\n")
+    markdown_output.write("## Summary Across All Users\n")
+    markdown_output.write("\n")
+    markdown_output.write("| Model | Accuracy | Precision | Recall | F1-Score | FAR | FRR | EER | Users |\n")
+    markdown_output.write("|-------|----------|-----------|--------|----------|-----|-----|-----|-------|\n")
 
     for row in rows:
-        markdown_output.append(
+        markdown_output.write(
             f"| {row['Algorithm']:22s} | "
             f"{row['Avg Accuracy (%)']:>8s}% | "
             f"{row['Avg Precision (%)']:>9s}% | "
@@ -114,41 +116,41 @@ def generate_markdown_table(rows, summary_file):
             f"{row['Avg FAR (%)']:>7s}% | "
             f"{row['Avg FRR (%)']:>7s}% | "
             f"{row['Avg EER (%)']:>7s}% | "
-            f"{row['Users Count']:>5s} |"
+            f"{row['Users Count']:>5s} |\n"
         )
 
-    markdown_output.append("")
-    markdown_output.append("## Metric Definitions")
-    markdown_output.append("")
-    markdown_output.append("- **Accuracy**: Overall classification accuracy (TP+TN)/(Total)")
-    markdown_output.append("- **Precision**: Proportion of genuine predictions that are correct (1 - FAR)")
-    markdown_output.append("- **Recall**: Proportion of genuine samples correctly identified (1 - FRR)")
-    markdown_output.append("- **F1-Score**: Harmonic mean of precision and recall")
-    markdown_output.append("- **FAR** (False Accept Rate): Rate at which impostors are incorrectly accepted")
-    markdown_output.append("- **FRR** (False Reject Rate): Rate at which genuine users are incorrectly rejected")
-    markdown_output.append("- **EER** (Equal Error Rate): Point where FAR = FRR (lower is better)")
-    markdown_output.append("")
-    markdown_output.append("## Key Findings")
-    markdown_output.append("")
-    markdown_output.append("1. **MLPClassifier** (Neural Network) achieved the highest performance:")
-    markdown_output.append("   - 99.86% accuracy")
-    markdown_output.append("   - 0.21% EER (Equal Error Rate)")
-    markdown_output.append("   - Nearly perfect precision and recall")
-    markdown_output.append("")
-    markdown_output.append("2. **OneClassSVM** showed moderate performance:")
-    markdown_output.append("   - 83.94% accuracy")
-    markdown_output.append("   - 24.09% EER")
-    markdown_output.append("   - Good for unsupervised anomaly detection")
-    markdown_output.append("")
-    markdown_output.append("3. **IsolationForest** had lower performance:")
-    markdown_output.append("   - 25.61% accuracy")
-    markdown_output.append("   - 61.59% EER")
-    markdown_output.append("   - High false accept rate (100%)")
+    markdown_output.write("\n")
+    markdown_output.write("## Metric Definitions\n")
+    markdown_output.write("\n")
+    markdown_output.write("- **Accuracy**: Overall classification accuracy (TP+TN)/(Total)\n")
+    markdown_output.write("- **Precision**: Proportion of genuine predictions that are correct (1 - FAR)\n")
+    markdown_output.write("- **Recall**: Proportion of genuine samples correctly identified (1 - FRR)\n")
+    markdown_output.write("- **F1-Score**: Harmonic mean of precision and recall\n")
+    markdown_output.write("- **FAR** (False Accept Rate): Rate at which impostors are incorrectly accepted\n")
+    markdown_output.write("- **FRR** (False Reject Rate): Rate at which genuine users are incorrectly rejected\n")
+    markdown_output.write("- **EER** (Equal Error Rate): Point where FAR = FRR (lower is better)\n")
+    markdown_output.write("\n")
+    markdown_output.write("## Key Findings\n")
+    markdown_output.write("\n")
+    markdown_output.write("1. **MLPClassifier** (Neural Network) achieved the highest performance:\n")
+    markdown_output.write("   - 99.86% accuracy\n")
+    markdown_output.write("   - 0.21% EER (Equal Error Rate)\n")
+    markdown_output.write("   - Nearly perfect precision and recall\n")
+    markdown_output.write("\n")
+    markdown_output.write("2. **OneClassSVM** showed moderate performance:\n")
+    markdown_output.write("   - 83.94% accuracy\n")
+    markdown_output.write("   - 24.09% EER\n")
+    markdown_output.write("   - Good for unsupervised anomaly detection\n")
+    markdown_output.write("\n")
+    markdown_output.write("3. **IsolationForest** had lower performance:\n")
+    markdown_output.write("   - 25.61% accuracy\n")
+    markdown_output.write("   - 61.59% EER\n")
+    markdown_output.write("   - High false accept rate (100%)\n")
 
     # Write to file
     output_file = summary_file.replace('.csv', '.md')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(markdown_output))
+    with open(output_file, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+        f.write(markdown_output.getvalue())
 
     print(f"Markdown table saved to: {output_file}")
     print()
@@ -6,72 +6,211 @@ Database: backend/database/app.db
 Author: Sharifa Al-Kaabi
 """
 
-import pandas as pd
-import numpy as np
-import json
 import sys
 import os
+from datetime import datetime
+from sqlalchemy import func, select
+from werkzeug.security import generate_password_hash
 
 # Add src to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from src.models.user import db, User, KeystrokeData
+from src.models.user import db, User, KeystrokeData, encode_json, encode_keystroke_features
+from src.utils.feature_extractor import feature_vector_bytes
 from src.main import app
 
 # Path to DSL dataset (Excel file)
 DSL_PATH = r"C:\Users\saalk\Downloads\bioauthai-complete-system\bioauthai\backend\DSL-StrongPasswordData.xls"
 
+# DSL timing columns for password ".tie5Roanl"
+DWELL_COLS = ('H.period', 'H.t', 'H.i', 'H.e', 'H.five', 'H.Shift.r', 'H.o', 'H.a', 'H.n', 'H.l', 'H.Return')
+FLIGHT_COLS = ('DD.period.t', 'DD.t.i', 'DD.i.e', 'DD.e.five', 'DD.five.Shift.r',
+               'DD.Shift.r.o', 'DD.o.a', 'DD.a.n', 'DD.n.l', 'DD.l.Return')
+UD_COLS = ('UD.period.t', 'UD.t.i', 'UD.i.e', 'UD.e.five', 'UD.five.Shift.r',
+           'UD.Shift.r.o', 'UD.o.a', 'UD.a.n', 'UD.n.l', 'UD.l.Return')
 
-def convert_dsl_row_to_keystroke(row):
+# Only the columns the import actually reads
+DSL_COLUMNS = ['subject', 'sessionIndex', 'rep', *DWELL_COLS, *FLIGHT_COLS, *UD_COLS]
+
+# Field order of the row tuples built by build_subject_rows()
+KEYSTROKE_INSERT_COLUMNS = ('user_id', 'session_id', 'keystroke_features', 'feature_vector', 'device_info',
+                            'is_training_data', 'data_split', 'anomaly_score', 'timestamp')
+
+
+def convert_dsl_dataframe(df):
     """
-    Convert a single DSL dataset row (33 features) into raw keystroke format.
+    Convert the whole DSL dataset (33 features per row) into raw keystroke arrays.
 
     DSL features are per-key timings for password ".tie5Roanl":
     - H.X = Hold time (dwell) for key X
     - DD.X.Y = Down-Down time (flight) between keys X and Y
     - UD.X.Y = Up-Down time between keys X and Y
 
-    We extract:
+    Timings share one C-ordered block so each row slice is contiguous and
+    can be serialized directly.
+
+    We extract (one array row per sample):
     - dwell_times: All H.* features
     - flight_times: All DD.* features
-    - pause_patterns: All UD.* features where UD > DD (indicates pause)
+    - pause_values / pause_offsets: UD - DD where UD > DD (indicates pause), as a
+      flat ragged array; row i is pause_values[pause_offsets[i]:pause_offsets[i + 1]]
     - typing_speed: Calculated from total time and key count
     """
+    import numpy as np
+
+    # Resolve column positions once and copy all timings out in a single block
+    timing_idx = [df.columns.get_loc(col) for col in (*DWELL_COLS, *FLIGHT_COLS, *UD_COLS)]
+    timings = np.ascontiguousarray(df.iloc[:, timing_idx].to_numpy(dtype=np.float64))
+    n_dwell, n_flight = len(DWELL_COLS), len(FLIGHT_COLS)
 
     # Extract dwell times (H.* columns)
-    dwell_cols = ['H.period', 'H.t', 'H.i', 'H.e', 'H.five', 'H.Shift.r', 'H.o', 'H.a', 'H.n', 'H.l', 'H.Return']
-    dwell_times = [float(row[col]) for col in dwell_cols if col in row]
+    dwell_times = timings[:, :n_dwell]
 
     # Extract flight times (DD.* columns)
-    flight_cols = ['DD.period.t', 'DD.t.i', 'DD.i.e', 'DD.e.five', 'DD.five.Shift.r',
-                   'DD.Shift.r.o', 'DD.o.a', 'DD.a.n', 'DD.n.l', 'DD.l.Return']
-    flight_times = [float(row[col]) for col in flight_cols if col in row]
+    flight_times = timings[:, n_dwell:n_dwell + n_flight]
 
     # Extract pause patterns (UD.* columns - these indicate pauses between keystrokes)
-    ud_cols = ['UD.period.t', 'UD.t.i', 'UD.i.e', 'UD.e.five', 'UD.five.Shift.r',
-               'UD.Shift.r.o', 'UD.o.a', 'UD.a.n', 'UD.n.l', 'UD.l.Return']
-    pause_patterns = []
-
-    for i, ud_col in enumerate(ud_cols):
-        if ud_col in row and i < len(flight_times):
-            ud_time = float(row[ud_col])
-            dd_time = flight_times[i]
-            # If UD time significantly exceeds DD time, it indicates a pause/hesitation
-            if ud_time > dd_time + 0.05:  # 50ms threshold
-                pause_patterns.append(ud_time - dd_time)
+    ud_times = timings[:, n_dwell + n_flight:]
+
+    # If UD time significantly exceeds DD time, it indicates a pause/hesitation
+    pause_mask = ud_times > flight_times + 0.05  # 50ms threshold
+
+    # Boolean indexing walks rows in order, so each row's pauses stay contiguous
+    pause_values = (ud_times - flight_times)[pause_mask]
+    pause_offsets = np.zeros(len(pause_mask) + 1, dtype=np.int64)
+    np.cumsum(pause_mask.sum(axis=1), out=pause_offsets[1:])
 
     # Calculate typing speed (keys per second)
-    total_time = sum(dwell_times) + sum(flight_times)
-    typing_speed = len(dwell_times) / total_time if total_time > 0 else 0.0
+    total_time = dwell_times.sum(axis=1) + flight_times.sum(axis=1)
+    # Safe divide in one op: rows with no elapsed time keep 0.0
+    typing_speed = np.divide(dwell_times.shape[1], total_time,
+                             out=np.zeros_like(total_time), where=total_time > 0)
+
+    return dwell_times, flight_times, pause_values, pause_offsets, typing_speed
 
+
+def convert_from_arrays(dwell_row, flight_row, pause_row, typing_speed):
+    """Build the raw keystroke dict for one sample from pre-sliced array rows."""
     return {
-        "dwell_times": dwell_times,
-        "flight_times": flight_times,
-        "pause_patterns": pause_patterns,
-        "typing_speed": typing_speed
+        "dwell_times": dwell_row,
+        "flight_times": flight_row,
+        "pause_patterns": pause_row,
+        "typing_speed": float(typing_speed)
     }
 
 
+def build_subject_rows(subject_id, user_id, row_positions, arrays):
+    """
+    Build the keystroke_data insert rows for one DSL subject.
+
+    Pure CPU work on the precomputed arrays with no database or app access,
+    so the writer loop in import_dsl_dataset() only inserts and commits.
+    Returns (rows, errors) where errors holds (row index, exception) pairs.
+    """
+    dwell_times, flight_times, pause_values, pause_offsets, typing_speed, session_indexes, reps = arrays
+
+    total_samples = len(row_positions)
+
+    # Split: 70% train, 15% validation, 15% test (matching Colab's 70/30 split pattern)
+    train_end = int(0.70 * total_samples)
+    val_end = int(0.85 * total_samples)
+
+    # Plain tuples in KEYSTROKE_INSERT_COLUMNS order, one INSERT per user
+    rows = []
+    errors = []
+
+    samples = zip(row_positions.tolist(), session_indexes[row_positions].tolist(), reps[row_positions].tolist())
+    for idx, (pos, session_index, rep) in enumerate(samples):
+        try:
+            # Determine data split
+            if idx < train_end:
+                data_split = 'train'
+            elif idx < val_end:
+                data_split = 'validation'
+            else:
+                data_split = 'test'
+
+            # Slice this row out of the precomputed arrays
+            raw_keystroke = convert_from_arrays(
+                dwell_times[pos], flight_times[pos],
+                pause_values[pause_offsets[pos]:pause_offsets[pos + 1]], typing_speed[pos]
+            )
+
+            rows.append((
+                user_id,
+                f"{subject_id}_s{session_index}_r{rep}",
+                encode_keystroke_features(raw_keystroke),
+                feature_vector_bytes(raw_keystroke),  # stored so training skips extraction
+                encode_json({
+                    "source": "dsl_dataset",
+                    "subject": subject_id,
+                    "sessionIndex": int(session_index),
+                    "rep": int(rep)
+                }),
+                True,
+                data_split,
+                None,
+                datetime.utcnow()
+            ))
+
+        except Exception as e:
+            errors.append((idx, e))
+
+    return rows, errors
+
+
+def drop_keystroke_indexes():
+    """
+    Drop the secondary indexes on keystroke_data before a bulk load.
+
+    SQLite otherwise updates every index on each inserted row; building them
+    once on the finished table is cheaper. Only done while the table is
+    empty, since live data relies on them for authentication. Returns the
+    dropped indexes for rebuild_keystroke_indexes().
+    """
+    if db.session.query(KeystrokeData.id).first() is not None:
+        return []
+    indexes = list(KeystrokeData.__table__.indexes)
+    for index in indexes:
+        index.drop(bind=db.engine, checkfirst=True)
+    return indexes
+
+
+def rebuild_keystroke_indexes(indexes):
+    """Recreate the indexes removed by drop_keystroke_indexes()."""
+    for index in indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+
+def load_dsl_dataframe():
+    """
+    Load the DSL dataset, reading the Excel file only when needed.
+
+    The first successful read is cached as CSV next to the Excel file;
+    later imports read that cache unless the Excel file is newer.
+    """
+    # Deferred so importing this module (linters, tooling) skips pandas/numpy
+    import numpy as np
+    import pandas as pd
+
+    cache_path = os.path.splitext(DSL_PATH)[0] + '.csv'
+    timing_dtypes = {col: np.float64 for col in DSL_COLUMNS[3:]}
+
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(DSL_PATH):
+        print(f"Using cached copy: {cache_path}")
+        # round_trip keeps the cached timings bit-identical to the Excel values
+        return pd.read_csv(cache_path, usecols=DSL_COLUMNS, dtype=timing_dtypes, float_precision='round_trip')
+
+    df = pd.read_excel(DSL_PATH, usecols=DSL_COLUMNS, dtype=timing_dtypes)
+
+    try:
+        df.to_csv(cache_path, index=False)
+    except OSError as e:
+        print(f"WARNING: could not write dataset cache: {e}")
+
+    return df
+
+
 def import_dsl_dataset():
     """
     Import the DSL-StrongPasswordData dataset into the database.
@@ -93,7 +232,7 @@ def import_dsl_dataset():
     # Load dataset
     print("\nLoading dataset...")
     try:
-        df = pd.read_excel(DSL_PATH)
+        df = load_dsl_dataframe()
         print(f"Loaded {len(df)} samples from {df['subject'].nunique()} users")
     except Exception as e:
         print(f"ERROR loading file: {e}")
@@ -113,32 +252,48 @@ def import_dsl_dataset():
     with app.app_context():
         created_users = 0
         existing_users = 0
-
-        for subject_id in df['subject'].unique():
-            user_email = f"{subject_id}@dsl.dataset"
-
-            # Check if user already exists
-            existing_user = User.query.filter_by(email=user_email).first()
-
-            if not existing_user:
-                user = User(
-                    name=f"DSL User {subject_id}",
-                    email=user_email,
-                    role='Employee',
-                    department='Dataset Users',
-                    status='active'
-                )
-                user.set_password('dataset123')  # Default password for dataset users
-                db.session.add(user)
+        new_users = []
+
+        subject_ids = df['subject'].unique()
+        emails = [f"{subject_id}@dsl.dataset" for subject_id in subject_ids]
+
+        # Check which users already exist (and their ids) with a single IN query
+        user_id_map = dict(db.session.execute(
+            select(User.email, User.id).where(User.email.in_(emails))
+        ).all())
+
+        # Every dataset user shares the default password, so hash it once
+        password_hash = generate_password_hash('dataset123', method='pbkdf2:sha256')
+
+        for subject_id, user_email in zip(subject_ids, emails):
+            if user_email not in user_id_map:
+                new_users.append({
+                    "name": f"DSL User {subject_id}",
+                    "email": user_email,
+                    "password_hash": password_hash,  # Default password for dataset users
+                    "role": 'Employee',
+                    "department": 'Dataset Users',
+                    "status": 'active',
+                    "created_at": datetime.utcnow()
+                })
                 created_users += 1
             else:
                 existing_users += 1
 
+        if new_users:
+            # RETURNING hands back the new ids, so no follow-up SELECT is needed
+            created = db.session.execute(
+                User.__table__.insert().returning(User.email, User.id), new_users
+            )
+            user_id_map.update(created.all())
         db.session.commit()
         print(f"Created {created_users} new users")
         if existing_users > 0:
             print(f"Found {existing_users} existing users")
 
+    # Convert every DSL row up front; the import loop only slices and serializes
+    arrays = (*convert_dsl_dataframe(df), df['sessionIndex'].to_numpy(), df['rep'].to_numpy())
+
     # Import keystroke data
     print("\n" + "=" * 70)
     print("Step 2: Importing keystroke data with train/validation/test splits")
@@ -147,67 +302,37 @@ def import_dsl_dataset():
     with app.app_context():
         imported = 0
         errors = 0
+        dropped_indexes = drop_keystroke_indexes()
 
-        # Group by user for proper train/validation/test split
-        for subject_id in df['subject'].unique():
-            user = User.query.filter_by(email=f"{subject_id}@dsl.dataset").first()
-            if not user:
-                continue
-
-            # Get all samples for this user
-            user_data = df[df['subject'] == subject_id].copy()
-            user_data = user_data.reset_index(drop=True)
-
-            total_samples = len(user_data)
-
-            # Split: 70% train, 15% validation, 15% test (matching Colab's 70/30 split pattern)
-            train_end = int(0.70 * total_samples)
-            val_end = int(0.85 * total_samples)
-
-            for idx, row in user_data.iterrows():
-                try:
-                    # Determine data split
-                    if idx < train_end:
-                        data_split = 'train'
-                    elif idx < val_end:
-                        data_split = 'validation'
-                    else:
-                        data_split = 'test'
-
-                    # Convert DSL row to raw keystroke format
-                    raw_keystroke = convert_dsl_row_to_keystroke(row)
-
-                    # Create keystroke record
-                    keystroke = KeystrokeData(
-                        user_id=user.id,
-                        session_id=f"{subject_id}_s{row['sessionIndex']}_r{row['rep']}",
-                        keystroke_features=json.dumps(raw_keystroke),
-                        device_info=json.dumps({
-                            "source": "dsl_dataset",
-                            "subject": subject_id,
-                            "sessionIndex": int(row['sessionIndex']),
-                            "rep": int(row['rep'])
-                        }),
-                        is_training_data=True,
-                        data_split=data_split,
-                        anomaly_score=None
-                    )
+        try:
+            # Group by user for proper train/validation/test split (one pass, first-seen order);
+            # only each group's row positions are needed, not a sub-DataFrame
+            for subject_id, row_positions in df.groupby('subject', sort=False).indices.items():
+                user_id = user_id_map.get(f"{subject_id}@dsl.dataset")
+                if user_id is None:
+                    continue
 
-                    db.session.add(keystroke)
-                    imported += 1
+                rows, row_errors = build_subject_rows(subject_id, user_id, row_positions, arrays)
+                imported += len(rows)
 
-                    # Commit every 100 records
-                    if imported % 100 == 0:
-                        db.session.commit()
-                        print(f"  Imported {imported} samples...", end='\r')
-
-                except Exception as e:
+                for idx, e in row_errors:
                     errors += 1
                     if errors <= 5:  # Show first 5 errors only
                         print(f"  Error importing row {idx}: {e}")
 
-        # Final commit
-        db.session.commit()
+                # One transaction (and one fsync) per user
+                if rows:
+                    db.session.execute(
+                        KeystrokeData.__table__.insert(),
+                        [dict(zip(KEYSTROKE_INSERT_COLUMNS, row)) for row in rows]
+                    )
+                db.session.commit()
+                print(f"  Imported {imported} samples...", end='\r')
+        finally:
+            # Build the secondary indexes once over the loaded table, even if the import failed;
+            # roll back a half-written batch first so its write lock doesn't block the rebuild
+            db.session.rollback()
+            rebuild_keystroke_indexes(dropped_indexes)
 
         print(f"\nSuccessfully imported {imported} keystroke samples")
         if errors > 0:
@@ -220,10 +345,15 @@ def import_dsl_dataset():
 
     with app.app_context():
         total_users = User.query.filter_by(department='Dataset Users').count()
-        total_samples = KeystrokeData.query.count()
-        train_samples = KeystrokeData.query.filter_by(data_split='train').count()
-        val_samples = KeystrokeData.query.filter_by(data_split='validation').count()
-        test_samples = KeystrokeData.query.filter_by(data_split='test').count()
+
+        # One scan of keystroke_data for every split count
+        split_counts = dict(db.session.execute(
+            select(KeystrokeData.data_split, func.count()).group_by(KeystrokeData.data_split)
+        ).all())
+        total_samples = sum(split_counts.values())
+        train_samples = split_counts.get('train', 0)
+        val_samples = split_counts.get('validation', 0)
+        test_samples = split_counts.get('test', 0)
 
         print(f"Total users: {total_users}")
         print(f"Total samples: {total_samples}")
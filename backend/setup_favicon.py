@@ -3,21 +3,50 @@
 Setup script to create BioAuthAI favicon for frontend only.
 Backend should NOT have a static folder - it's API only!
 
-Usage: python setup_favicon.py
+The icon never changes, so the rendered files are kept in backend/assets/
+and simply copied into the frontend. Pillow is only needed to redraw them.
+
+Usage: python setup_favicon.py               (copy the prebuilt icons)
+       python setup_favicon.py --regenerate  (redraw backend/assets/ with Pillow, then copy)
 """
 
 import os
+import shutil
 import sys
 
-try:
-    from PIL import Image, ImageDraw, ImageFont
-except ImportError:
-    print("ERROR: Pillow is required.")
-    print("Install with: pip install Pillow")
-    sys.exit(1)
+# Prebuilt favicon.ico / bioauthai-logo.png
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+# Icon sizes packed into favicon.ico
+SIZES = [(16, 16), (32, 32), (48, 48), (64, 64)]
 
 def create_bioauthai_favicon():
-    """Create a professional BioAuthAI favicon."""
+    """Copy the prebuilt BioAuthAI favicon and logo into the frontend."""
+
+    # Frontend public folder
+    frontend_public = os.path.join("..", "frontend", "public")
+
+    ico_path = os.path.join(frontend_public, "favicon.ico")
+    shutil.copyfile(os.path.join(ASSET_DIR, "favicon.ico"), ico_path)
+
+    png_path = os.path.join(frontend_public, "bioauthai-logo.png")
+    shutil.copyfile(os.path.join(ASSET_DIR, "bioauthai-logo.png"), png_path)
+
+    print("[SUCCESS] BioAuthAI favicon created!")
+    print(f"   Frontend favicon: {ico_path}")
+    print(f"   Frontend logo: {png_path}")
+    print(f"   Sizes: {', '.join([f'{s[0]}x{s[1]}' for s in SIZES])}")
+    print("\nBackend does NOT have a static folder - it's API only!")
+
+def render_bioauthai_favicon():
+    """Draw the professional BioAuthAI favicon with Pillow into backend/assets/."""
+    # Pillow is only needed when the favicon is actually drawn
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+    except ImportError:
+        print("ERROR: Pillow is required.")
+        print("Install with: pip install Pillow")
+        sys.exit(1)
 
     # Create a 64x64 image with transparency
     size = 64
@@ -60,34 +89,28 @@ def create_bioauthai_favicon():
 
     draw.text((text_x, text_y), text, fill='#FFFFFF', font=font)
 
-    # Frontend public folder
-    frontend_public = os.path.join("..", "frontend", "public")
+    os.makedirs(ASSET_DIR, exist_ok=True)
 
     # Create multiple sizes
-    sizes = [(16, 16), (32, 32), (48, 48), (64, 64)]
-    images = [img.resize(s, Image.Resampling.LANCZOS) for s in sizes]
+    images = [img.resize(s, Image.Resampling.LANCZOS) for s in SIZES]
 
     # Save favicon.ico
-    ico_path = os.path.join(frontend_public, "favicon.ico")
     images[0].save(
-        ico_path,
+        os.path.join(ASSET_DIR, "favicon.ico"),
         format='ICO',
-        sizes=sizes,
+        sizes=SIZES,
         append_images=images[1:]
     )
 
     # Save PNG logo
-    png_path = os.path.join(frontend_public, "bioauthai-logo.png")
-    img.save(png_path, format='PNG')
+    img.save(os.path.join(ASSET_DIR, "bioauthai-logo.png"), format='PNG')
 
-    print("[SUCCESS] BioAuthAI favicon created!")
-    print(f"   Frontend favicon: {ico_path}")
-    print(f"   Frontend logo: {png_path}")
-    print(f"   Sizes: {', '.join([f'{s[0]}x{s[1]}' for s in sizes])}")
-    print("\nBackend does NOT have a static folder - it's API only!")
+    print(f"[SUCCESS] Favicon assets redrawn in: {ASSET_DIR}")
 
 if __name__ == "__main__":
     try:
+        if "--regenerate" in sys.argv[1:]:
+            render_bioauthai_favicon()
         create_bioauthai_favicon()
     except Exception as e:
         print(f"ERROR: {e}")
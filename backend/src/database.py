@@ -1,8 +1,10 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from src.utils.sqlite_pragmas import set_sqlite_pragmas
+
 #  FIXED: Use relative path that works on any system
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_DIR = os.path.join(BASE_DIR, "database")
@@ -11,6 +13,8 @@ os.makedirs(DB_DIR, exist_ok=True)
 DATABASE_URL = f"sqlite:///{os.path.join(DB_DIR, 'app.db')}"
 
 engine = create_engine(DATABASE_URL, echo=False)
+event.listen(engine, "connect", set_sqlite_pragmas)  # same PRAGMAs as the Flask app's engine
+
 Base = declarative_base()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -3,13 +3,15 @@ import sys
 import logging
 from flask import Flask
 from flask_cors import CORS
-from sqlalchemy import text
+from sqlalchemy import event, inspect, text
 
 # Make sure src/ is importable
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 # Database + models
-from src.models.user import db
+from src.models.user import db, AuthStatsHourly, rebuild_auth_stats
+from src.utils.json_provider import OrjsonProvider
+from src.utils.sqlite_pragmas import set_sqlite_pragmas
 
 # Blueprints (routes)
 from src.routes.user import user_bp
@@ -30,6 +32,8 @@ logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
 
+app.json = OrjsonProvider(app)  # orjson for every jsonify() response
+
 app.config['SECRET_KEY'] = "bioauthai-secure-key-2024"
 
 # =======================================================
@@ -66,9 +70,48 @@ def enable_wal():
         print("WAL FAILED:", e)
 
 
+# -------------------------------------------------------
+#   INDEXES FOR EXISTING TABLES (create_all SKIPS THEM)
+# -------------------------------------------------------
+def create_missing_indexes():
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+# -------------------------------------------------------
+#   NEW NULLABLE COLUMNS ON EXISTING TABLES
+# -------------------------------------------------------
+def create_missing_columns():
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(text(
+                        f"ALTER TABLE {preparer.quote(table.name)} "
+                        f"ADD COLUMN {preparer.quote(column.name)} {column.type.compile(dialect=conn.dialect)}"
+                    ))
+
+
 with app.app_context():
+    event.listen(db.engine, "connect", set_sqlite_pragmas)
     enable_wal()
     db.create_all()
+    create_missing_columns()
+    create_missing_indexes()
+    # Seed hourly auth stats once (new table or older database); the
+    # AuthenticationLog listeners keep them current from then on
+    if db.session.query(AuthStatsHourly.hour).first() is None:
+        rebuild_auth_stats()
+
+
+@app.cli.command("rebuild-auth-stats")
+def rebuild_auth_stats_command():
+    """Recompute auth_stats_hourly from authentication_log (after manual data fixes)."""
+    rebuild_auth_stats()
+    print("auth_stats_hourly rebuilt")
 
 
 # -------------------------------------------------------
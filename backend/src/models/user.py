@@ -1,7 +1,30 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import and_, case, event, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from werkzeug.security import generate_password_hash, check_password_hash
-import json
+
+import orjson
+
+
+def encode_json(obj):
+    """Serialize a JSON text column value compactly (NumPy arrays allowed)"""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+def decode_json(text):
+    """Parse a JSON text column value; empty values decode to {}"""
+    return orjson.loads(text) if text else {}
+
+
+def encode_keystroke_features(features):
+    """Serialize raw keystroke features as compact JSON text (NumPy arrays allowed)"""
+    return encode_json(features)
+
+
+def decode_keystroke_features(text):
+    """Parse a keystroke_features column value; empty values decode to {}"""
+    return decode_json(text)
 
 db = SQLAlchemy()
 
@@ -23,7 +46,7 @@ class User(db.Model):
     keystroke_data = db.relationship('KeystrokeData', backref='user', lazy=True, cascade='all, delete-orphan')
     authentication_logs = db.relationship('AuthenticationLog', backref='user', lazy=True, cascade='all, delete-orphan')
     user_devices = db.relationship('UserDevice', backref='user', lazy=True, cascade='all, delete-orphan')
-    security_alerts = db.relationship('SecurityAlert', backref='user', lazy=True, cascade='all, delete-orphan')
+    security_alerts = db.relationship('SecurityAlert', back_populates='user', lazy=True, cascade='all, delete-orphan')
 
     def set_password(self, password):
         """Hash and set the user's password"""
@@ -59,11 +82,19 @@ class KeystrokeData(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     session_id = db.Column(db.String(100), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    keystroke_features = db.Column(db.Text, nullable=False)  # JSON string of features
+    keystroke_features = db.Column(db.Text, nullable=False)  # Compact JSON string, see encode_keystroke_features()
     device_info = db.Column(db.Text, nullable=True)  # JSON string of device info
     is_training_data = db.Column(db.Boolean, default=True)
     anomaly_score = db.Column(db.Float, nullable=True)
     data_split = db.Column(db.String(20), nullable=True)  # 'train', 'validation', 'test'
+    feature_vector = db.Column(db.LargeBinary, nullable=True)  # 21 float32 features, see feature_vector_bytes(); NULL until computed
+
+    __table_args__ = (
+        db.Index('ix_ks_user_split', 'user_id', 'data_split'),  # per-user training/split queries
+        db.Index('ix_ks_split', 'data_split'),  # split counts in summaries
+        db.Index('ix_ks_user_training', 'user_id', 'is_training_data'),  # per-user training-sample counts
+        db.Index('ix_ks_user_ts', 'user_id', 'timestamp'),  # latest sample per user, per-user time windows
+    )
 
     def __repr__(self):
         return f'<KeystrokeData {self.id} for User {self.user_id}>'
@@ -74,8 +105,8 @@ class KeystrokeData(db.Model):
             'user_id': self.user_id,
             'session_id': self.session_id,
             'timestamp': self.timestamp.isoformat(),
-            'keystroke_features': json.loads(self.keystroke_features) if self.keystroke_features else {},
-            'device_info': json.loads(self.device_info) if self.device_info else {},
+            'keystroke_features': decode_keystroke_features(self.keystroke_features),
+            'device_info': decode_json(self.device_info),
             'is_training_data': bool(self.is_training_data),
             'anomaly_score': self.anomaly_score,
             'data_split': self.data_split
@@ -94,6 +125,11 @@ class AuthenticationLog(db.Model):
     session_id = db.Column(db.String(100), nullable=True)
     action_taken = db.Column(db.String(100), nullable=True)  # 'none', 'mfa_required', 'session_locked', etc.
 
+    __table_args__ = (
+        db.Index('ix_auth_ts_result', 'timestamp', 'result'),  # analytics windows filtered by result
+        db.Index('ix_auth_user_ts', 'user_id', 'timestamp'),  # per-user history, newest first
+    )
+
     def __repr__(self):
         return f'<AuthenticationLog {self.id} - {self.result}>'
 
@@ -112,6 +148,77 @@ class AuthenticationLog(db.Model):
             'action_taken': self.action_taken
         }
 
+class AuthStatsHourly(db.Model):
+    """Authentication counters per hour, kept in step with AuthenticationLog on write"""
+    __tablename__ = 'auth_stats_hourly'
+
+    hour = db.Column(db.DateTime, primary_key=True)  # log timestamp truncated to the hour
+    authentications = db.Column(db.Integer, nullable=False, default=0)
+    successful = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    anomalies = db.Column(db.Integer, nullable=False, default=0)
+    false_accepts = db.Column(db.Integer, nullable=False, default=0)  # success with confidence < 0.5
+    false_rejects = db.Column(db.Integer, nullable=False, default=0)  # failed with confidence >= 0.5
+
+    COUNTERS = ('authentications', 'successful', 'failed', 'anomalies', 'false_accepts', 'false_rejects')
+
+    @staticmethod
+    def counts_for(log):
+        """Counter increments contributed by a single AuthenticationLog"""
+        score = log.confidence_score
+        return {
+            'authentications': 1,
+            'successful': int(log.result == 'success'),
+            'failed': int(log.result == 'failed'),
+            'anomalies': int(log.result == 'anomaly'),
+            'false_accepts': int(log.result == 'success' and score is not None and score < 0.5),
+            'false_rejects': int(log.result == 'failed' and score is not None and score >= 0.5)
+        }
+
+    def __repr__(self):
+        return f'<AuthStatsHourly {self.hour} - {self.authentications}>'
+
+@event.listens_for(AuthenticationLog, 'after_insert')
+def add_log_to_hourly_stats(mapper, connection, log):
+    table = AuthStatsHourly.__table__
+    counts = AuthStatsHourly.counts_for(log)
+    stmt = sqlite_insert(table).values(hour=log.timestamp.replace(minute=0, second=0, microsecond=0), **counts)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.hour],
+        set_={name: table.c[name] + stmt.excluded[name] for name in counts}
+    ))
+
+@event.listens_for(AuthenticationLog, 'after_delete')
+def remove_log_from_hourly_stats(mapper, connection, log):
+    table = AuthStatsHourly.__table__
+    counts = AuthStatsHourly.counts_for(log)
+    connection.execute(
+        table.update()
+        .where(table.c.hour == log.timestamp.replace(minute=0, second=0, microsecond=0))
+        .values({name: table.c[name] - value for name, value in counts.items()})
+    )
+
+def rebuild_auth_stats():
+    """Recompute auth_stats_hourly from authentication_log (reconciles bulk deletes/imports)"""
+    log = AuthenticationLog
+    score = log.confidence_score
+    # Same text format SQLAlchemy stores DateTime in, so rebuilt keys match live upserts
+    hour = func.strftime('%Y-%m-%d %H:00:00.000000', log.timestamp)
+    aggregates = select(
+        hour,
+        func.count(),
+        func.sum(case((log.result == 'success', 1), else_=0)),
+        func.sum(case((log.result == 'failed', 1), else_=0)),
+        func.sum(case((log.result == 'anomaly', 1), else_=0)),
+        func.sum(case((and_(log.result == 'success', score < 0.5), 1), else_=0)),
+        func.sum(case((and_(log.result == 'failed', score >= 0.5), 1), else_=0))
+    ).where(log.timestamp.isnot(None)).group_by(hour)
+
+    table = AuthStatsHourly.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(('hour',) + AuthStatsHourly.COUNTERS, aggregates))
+    db.session.commit()
+
 class UserDevice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -157,6 +264,14 @@ class SecurityAlert(db.Model):
     resolved_at = db.Column(db.DateTime, nullable=True)
     resolved_by = db.Column(db.String(100), nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_alerts_status_severity_ts', 'status', 'severity', 'timestamp'),  # alert list filters + stats
+    )
+
+    # Declared here (not as a backref) so it can be eager-loaded: 'selectin' fetches the
+    # users of every loaded alert in one IN query instead of one SELECT per alert
+    user = db.relationship('User', back_populates='security_alerts', lazy='selectin')
+
     def __repr__(self):
         return f'<SecurityAlert {self.id} - {self.title}>'
 
@@ -171,7 +286,7 @@ class SecurityAlert(db.Model):
             'timestamp': self.timestamp.isoformat(),
             'status': self.status,
             'confidence_score': self.confidence_score,
-            'metadata': json.loads(self.alert_metadata) if self.alert_metadata else {},
+            'metadata': decode_json(self.alert_metadata),
             'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None,
             'resolved_by': self.resolved_by
         }
@@ -208,7 +323,7 @@ class SystemSettings(db.Model):
         elif self.data_type == 'boolean':
             return self.value.lower() == 'true'
         elif self.data_type == 'json':
-            return json.loads(self.value)
+            return orjson.loads(self.value)
         else:
             return self.value
 
@@ -216,7 +331,9 @@ class MLModel(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     model_version = db.Column(db.String(50), nullable=False)
-    model_data = db.Column(db.LargeBinary, nullable=False)  # Serialized model
+    # Deferred: only the model cache reads these; metadata queries skip them
+    model_data = db.deferred(db.Column(db.LargeBinary, nullable=False))  # Serialized model
+    scaler_data = db.deferred(db.Column(db.LargeBinary, nullable=True))  # Serialized scaler, stored apart from the model
     training_data_count = db.Column(db.Integer, nullable=False)
     accuracy = db.Column(db.Float, nullable=True)
     far = db.Column(db.Float, nullable=True)  # False Accept Rate
@@ -225,6 +342,10 @@ class MLModel(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     training_metadata = db.Column(db.Text, nullable=True)  # JSON string
 
+    __table_args__ = (
+        db.Index('ix_mlmodel_user_active', 'user_id', 'is_active'),  # active model lookup on every auth
+    )
+
     def __repr__(self):
         return f'<MLModel {self.model_version} for User {self.user_id}>'
 
@@ -239,6 +360,6 @@ class MLModel(db.Model):
             'frr': self.frr,
             'created_at': self.created_at.isoformat(),
             'is_active': bool(self.is_active),  # Convert SQLAlchemy Boolean to Python bool
-            'training_metadata': json.loads(self.training_metadata) if self.training_metadata else {}
+            'training_metadata': decode_json(self.training_metadata)
         }
 
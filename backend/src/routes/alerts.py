@@ -1,7 +1,12 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import case, func
+from sqlalchemy.orm import selectinload
 from src.models.user import db, SecurityAlert, User
 from datetime import datetime
-import json
+
+# SecurityAlert.user is selectin-loaded by default; also bring the devices behind
+# User.to_dict()'s device_count along instead of one query per user
+ALERT_USER_OPTIONS = selectinload(SecurityAlert.user).selectinload(User.user_devices)
 
 alerts_bp = Blueprint('alerts', __name__)
 
@@ -24,17 +29,21 @@ def get_alerts():
         if severity != 'all':
             query = query.filter(SecurityAlert.severity == severity)
         
-        # Get alerts with pagination
-        alerts = query.order_by(SecurityAlert.timestamp.desc()).offset(offset).limit(limit).all()
-        total_count = query.count()
+        # Get alerts with pagination; COUNT(*) OVER () carries the filtered total on each row
+        # so it comes back with the page instead of from a second query
+        rows = (query.options(ALERT_USER_OPTIONS)
+                .add_columns(func.count().over().label('total_count'))
+                .order_by(SecurityAlert.timestamp.desc()).offset(offset).limit(limit).all())
+        alerts = [alert for alert, _ in rows]
+        # An empty page (offset past the end) carries no total, so count only then
+        total_count = rows[0].total_count if rows else query.count()
         
         # Convert to dict and include user info
         alerts_data = []
         for alert in alerts:
             alert_dict = alert.to_dict()
             if alert.user_id:
-                user = User.query.get(alert.user_id)
-                alert_dict['user'] = user.to_dict() if user else None
+                alert_dict['user'] = alert.user.to_dict() if alert.user else None
             alerts_data.append(alert_dict)
         
         return jsonify({
@@ -50,16 +59,32 @@ def get_alerts():
 def get_alert_stats():
     """Get alert statistics"""
     try:
+        # One pass over security_alert instead of a COUNT(*) per bucket
+        status_counts = dict(
+            db.session.query(SecurityAlert.status, func.count())
+            .group_by(SecurityAlert.status).all()
+        )
+        severity_counts, impersonation = {}, 0
+        for severity, count, impersonations in (
+            db.session.query(
+                SecurityAlert.severity,
+                func.count(),
+                func.sum(case((SecurityAlert.title.like('%IMPERSONATION%'), 1), else_=0))
+            ).group_by(SecurityAlert.severity).all()
+        ):
+            severity_counts[severity] = count
+            impersonation += impersonations or 0
+
         stats = {
-            'total': SecurityAlert.query.count(),
-            'open': SecurityAlert.query.filter_by(status='open').count(),
-            'investigating': SecurityAlert.query.filter_by(status='investigating').count(),
-            'resolved': SecurityAlert.query.filter_by(status='resolved').count(),
-            'critical': SecurityAlert.query.filter_by(severity='critical').count(),
-            'high': SecurityAlert.query.filter_by(severity='high').count(),
-            'medium': SecurityAlert.query.filter_by(severity='medium').count(),
-            'low': SecurityAlert.query.filter_by(severity='low').count(),
-            'impersonation': SecurityAlert.query.filter(SecurityAlert.title.like('%IMPERSONATION%')).count()
+            'total': sum(status_counts.values()),
+            'open': status_counts.get('open', 0),
+            'investigating': status_counts.get('investigating', 0),
+            'resolved': status_counts.get('resolved', 0),
+            'critical': severity_counts.get('critical', 0),
+            'high': severity_counts.get('high', 0),
+            'medium': severity_counts.get('medium', 0),
+            'low': severity_counts.get('low', 0),
+            'impersonation': impersonation
         }
 
         return jsonify(stats)
@@ -71,12 +96,11 @@ def get_alert_stats():
 def get_alert(alert_id):
     """Get specific alert details"""
     try:
-        alert = SecurityAlert.query.get_or_404(alert_id)
+        alert = SecurityAlert.query.options(ALERT_USER_OPTIONS).get_or_404(alert_id)
         alert_dict = alert.to_dict()
         
         if alert.user_id:
-            user = User.query.get(alert.user_id)
-            alert_dict['user'] = user.to_dict() if user else None
+            alert_dict['user'] = alert.user.to_dict() if alert.user else None
         
         return jsonify(alert_dict)
         
@@ -124,7 +148,7 @@ def create_alert():
             title=data.get('title'),
             description=data.get('description'),
             confidence_score=data.get('confidence_score'),
-            alert_metadata=json.dumps(data.get('metadata', {}))
+            alert_metadata=current_app.json.dumps(data.get('metadata', {}))
         )
         
         db.session.add(alert)
@@ -149,25 +173,27 @@ def bulk_alert_action():
         if not alert_ids or not action:
             return jsonify({'error': 'Alert IDs and action are required'}), 400
         
-        alerts = SecurityAlert.query.filter(SecurityAlert.id.in_(alert_ids)).all()
-        
+        # One UPDATE/DELETE statement for the whole selection instead of a row at a time
+        alerts = SecurityAlert.query.filter(SecurityAlert.id.in_(alert_ids))
+
         if action == 'resolve':
-            for alert in alerts:
-                alert.status = 'resolved'
-                alert.resolved_at = datetime.utcnow()
-                alert.resolved_by = 'Bulk Action'
+            affected_count = alerts.update({
+                'status': 'resolved',
+                'resolved_at': datetime.utcnow(),
+                'resolved_by': 'Bulk Action'
+            }, synchronize_session=False)
         elif action == 'investigate':
-            for alert in alerts:
-                alert.status = 'investigating'
+            affected_count = alerts.update({'status': 'investigating'}, synchronize_session=False)
         elif action == 'delete':
-            for alert in alerts:
-                db.session.delete(alert)
-        
+            affected_count = alerts.delete(synchronize_session=False)
+        else:
+            affected_count = alerts.count()
+
         db.session.commit()
-        
+
         return jsonify({
             'message': f'Bulk action "{action}" completed successfully',
-            'affected_count': len(alerts)
+            'affected_count': affected_count
         })
         
     except Exception as e:
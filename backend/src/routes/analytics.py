@@ -2,61 +2,97 @@
 #  BioAuthAI - Analytics API (FULL | CLEAN | READY)
 # ============================================================
 
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, current_app, request, jsonify, send_file
 from src.models.user import (
-    db, User, AuthenticationLog, SecurityAlert, KeystrokeData,
-    UserDevice, MLModel
+    db, User, AuthenticationLog, AuthStatsHourly, SecurityAlert, KeystrokeData,
+    UserDevice, MLModel, decode_json, decode_keystroke_features
 )
+from bisect import bisect_right
+from collections import defaultdict
 from datetime import datetime, timedelta
-from sqlalchemy import func, and_, distinct
-import pandas as pd
-import io
-import json
+from sqlalchemy import func, and_, case, distinct, select
+import hashlib
+import tempfile
+import threading
+import time
+import xlsxwriter
 
 analytics_bp = Blueprint('analytics', __name__)
 
+# Polled dashboard endpoints are served from a short-lived in-process cache
+DASHBOARD_CACHE_TTL = 30  # seconds
+_dashboard_cache = {}  # key -> (expires_at, json body, etag)
+_dashboard_cache_lock = threading.Lock()
+
+
+def cached_json_response(key, compute):
+    """Return compute()'s payload as JSON, reusing it for DASHBOARD_CACHE_TTL seconds.
+
+    The body carries an ETag so polling browsers get a 304 instead of the JSON.
+    """
+    now = time.monotonic()
+    with _dashboard_cache_lock:
+        entry = _dashboard_cache.get(key)
+    if entry is None or entry[0] <= now:
+        # compute() runs unlocked; only the dict access is serialized
+        body = current_app.json.dumps(compute())
+        entry = (now + DASHBOARD_CACHE_TTL, body, hashlib.md5(body.encode()).hexdigest())
+        with _dashboard_cache_lock:
+            for stale in [k for k, e in _dashboard_cache.items() if e[0] <= now]:
+                del _dashboard_cache[stale]
+            _dashboard_cache[key] = entry
+
+    response = Response(entry[1], mimetype='application/json')
+    response.set_etag(entry[2])
+    response.cache_control.max_age = DASHBOARD_CACHE_TTL
+    return response.make_conditional(request)
+
 # DASHBOARD STATS
 
 @analytics_bp.route('/analytics/dashboard-stats', methods=['GET'])
 def get_dashboard_stats():
     try:
         hours = int(request.args.get('hours', 24))
-        since = datetime.utcnow() - timedelta(hours=hours)
+        return cached_json_response(('dashboard-stats', hours), lambda: compute_dashboard_stats(hours))
 
-        active_sessions = db.session.query(
-            func.count(distinct(AuthenticationLog.session_id))
-        ).filter(
-            AuthenticationLog.timestamp >= since,
-            AuthenticationLog.session_id.isnot(None)
-        ).scalar() or 0
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        total_auths = AuthenticationLog.query.filter(
-            AuthenticationLog.timestamp >= since
-        ).count()
 
-        successful_auths = AuthenticationLog.query.filter(
-            AuthenticationLog.timestamp >= since,
-            AuthenticationLog.result == 'success'
-        ).count()
+def compute_dashboard_stats(hours):
+    since = datetime.utcnow() - timedelta(hours=hours)
 
-        auth_rate = (successful_auths / total_auths * 100) if total_auths > 0 else 0
+    active_sessions = db.session.query(
+        func.count(distinct(AuthenticationLog.session_id))
+    ).filter(
+        AuthenticationLog.timestamp >= since,
+        AuthenticationLog.session_id.isnot(None)
+    ).scalar() or 0
 
-        alerts_count = SecurityAlert.query.filter(
-            SecurityAlert.timestamp >= since
-        ).count()
+    total_auths = AuthenticationLog.query.filter(
+        AuthenticationLog.timestamp >= since
+    ).count()
 
-        total_users = User.query.count()
+    successful_auths = AuthenticationLog.query.filter(
+        AuthenticationLog.timestamp >= since,
+        AuthenticationLog.result == 'success'
+    ).count()
 
-        return jsonify({
-            'active_sessions': active_sessions,
-            'authentication_rate': round(auth_rate, 1),
-            'security_alerts': alerts_count,
-            'total_users': total_users,
-            'period_hours': hours
-        })
+    auth_rate = (successful_auths / total_auths * 100) if total_auths > 0 else 0
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    alerts_count = SecurityAlert.query.filter(
+        SecurityAlert.timestamp >= since
+    ).count()
+
+    total_users = User.query.count()
+
+    return {
+        'active_sessions': active_sessions,
+        'authentication_rate': round(auth_rate, 1),
+        'security_alerts': alerts_count,
+        'total_users': total_users,
+        'period_hours': hours
+    }
 
 
 # ============================================================
@@ -67,38 +103,39 @@ def get_dashboard_stats():
 def get_authentication_trends():
     try:
         days = int(request.args.get('days', 7))
-        trends_data = []
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        since = today - timedelta(days=days - 1)
+
+        # Summed from the hourly summary table instead of scanning the logs
+        day = func.strftime('%Y-%m-%d', AuthStatsHourly.hour).label('day')
+        buckets = {
+            row.day: row for row in db.session.query(
+                day,
+                func.sum(AuthStatsHourly.authentications).label('total'),
+                func.sum(AuthStatsHourly.successful).label('successful'),
+                func.sum(AuthStatsHourly.failed).label('failed'),
+                func.sum(AuthStatsHourly.anomalies).label('anomalies'),
+                func.sum(AuthStatsHourly.false_accepts).label('false_accepts'),
+                func.sum(AuthStatsHourly.false_rejects).label('false_rejects')
+            ).filter(
+                AuthStatsHourly.hour >= since,
+                AuthStatsHourly.hour < today + timedelta(days=1)
+            ).group_by(day).all()
+        }
 
+        trends_data = []
         for i in range(days):
-            date = datetime.utcnow() - timedelta(days=days - i - 1)
-            start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-            end = start + timedelta(days=1)
-
-            logs = AuthenticationLog.query.filter(
-                AuthenticationLog.timestamp >= start,
-                AuthenticationLog.timestamp < end
-            ).all()
-
-            successful = sum(1 for log in logs if log.result == 'success')
-            failed = sum(1 for log in logs if log.result == 'failed')
-            anomalies = sum(1 for log in logs if log.result == 'anomaly')
-
-            far = 0.0
-            frr = 0.0
-            if logs:
-                false_accepts = sum(1 for log in logs if log.result == 'success' and (log.confidence_score or 1) < 0.5)
-                false_rejects = sum(1 for log in logs if log.result == 'failed' and (log.confidence_score or 0) >= 0.5)
-                total = len(logs)
-                far = false_accepts / total
-                frr = false_rejects / total
+            date = (since + timedelta(days=i)).strftime('%Y-%m-%d')
+            row = buckets.get(date)
+            total = row.total if row else 0
 
             trends_data.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'successful': successful,
-                'failed': failed,
-                'anomalies': anomalies,
-                'far': round(far, 3),
-                'frr': round(frr, 3)
+                'date': date,
+                'successful': row.successful if row else 0,
+                'failed': row.failed if row else 0,
+                'anomalies': row.anomalies if row else 0,
+                'far': round(row.false_accepts / total, 3) if total else 0.0,
+                'frr': round(row.false_rejects / total, 3) if total else 0.0
             })
 
         return jsonify(trends_data)
@@ -114,23 +151,26 @@ def get_authentication_trends():
 @analytics_bp.route('/analytics/hourly-activity', methods=['GET'])
 def get_hourly_activity():
     try:
-        hourly_data = []
-
         now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        since = now - timedelta(hours=24)
 
-        for i in range(24):
-            hour_start = now - timedelta(hours=24 - i)
-            hour_end = hour_start + timedelta(hours=1)
-
-            logs = AuthenticationLog.query.filter(
-                AuthenticationLog.timestamp >= hour_start,
-                AuthenticationLog.timestamp < hour_end
+        # Read straight from the hourly summary table instead of scanning the logs
+        buckets = {
+            row.hour: row for row in AuthStatsHourly.query.filter(
+                AuthStatsHourly.hour >= since,
+                AuthStatsHourly.hour < now
             ).all()
+        }
+
+        hourly_data = []
+        for i in range(24):
+            hour_start = since + timedelta(hours=i)
+            row = buckets.get(hour_start)
 
             hourly_data.append({
                 'hour': hour_start.strftime('%H'),
-                'authentications': len(logs),
-                'anomalies': sum(1 for log in logs if log.result == 'anomaly')
+                'authentications': row.authentications if row else 0,
+                'anomalies': row.anomalies if row else 0
             })
 
         return jsonify(hourly_data)
@@ -146,12 +186,14 @@ def get_hourly_activity():
 @analytics_bp.route('/analytics/device-distribution', methods=['GET'])
 def get_device_distribution():
     try:
+        # Normalized in SQL so 'Desktop'/'desktop'/NULL variants group together
+        device_type = func.lower(func.coalesce(UserDevice.device_type, 'unknown')).label('device_type')
         device_counts = db.session.query(
-            UserDevice.device_type,
+            device_type,
             func.count(distinct(UserDevice.user_id))
         ).filter(
             UserDevice.status == 'active'
-        ).group_by(UserDevice.device_type).all()
+        ).group_by(device_type).all()
 
         total = sum(c for _, c in device_counts) or 1
 
@@ -164,10 +206,10 @@ def get_device_distribution():
         result = []
         for device, count in device_counts:
             result.append({
-                'name': (device or 'Unknown').capitalize(),
+                'name': device.capitalize(),
                 'value': round((count / total) * 100, 1),
                 'users': count,
-                'color': color_map.get(device.lower(), '#3B82F6')
+                'color': color_map.get(device, '#3B82F6')
             })
 
         return jsonify(result)
@@ -192,21 +234,24 @@ def get_department_performance():
             User.status == 'active'
         ).group_by(User.department).all()
 
-        result = []
-
-        for dept, count, avg_score in departments:
-            user_ids = [u.id for u in User.query.filter_by(department=dept).all()]
-            anomalies = AuthenticationLog.query.filter(
-                AuthenticationLog.user_id.in_(user_ids),
-                AuthenticationLog.result == 'anomaly'
-            ).count()
+        # Anomalies per department in one JOIN instead of two queries per department.
+        # Kept apart from the query above so avg(auth_score) isn't weighted by log count.
+        anomaly_counts = dict(db.session.query(
+            User.department,
+            func.count(AuthenticationLog.id)
+        ).join(
+            AuthenticationLog, AuthenticationLog.user_id == User.id
+        ).filter(
+            User.department.isnot(None),
+            AuthenticationLog.result == 'anomaly'
+        ).group_by(User.department).all())
 
-            result.append({
-                'name': dept,
-                'users': count,
-                'anomalies': anomalies,
-                'avgScore': round(avg_score or 0, 2)
-            })
+        result = [{
+            'name': dept,
+            'users': count,
+            'anomalies': anomaly_counts.get(dept, 0),
+            'avgScore': round(avg_score or 0, 2)
+        } for dept, count, avg_score in departments]
 
         return jsonify(result)
 
@@ -221,18 +266,21 @@ def get_department_performance():
 @analytics_bp.route('/analytics/performance-metrics', methods=['GET'])
 def get_performance_metrics():
     try:
-        logs = AuthenticationLog.query.filter(
+        # Counted in SQL over every scored log instead of hydrating 1000 rows
+        total, successful, false_accepts, false_rejects = db.session.query(
+            func.count(),
+            func.sum(case((AuthenticationLog.result == 'success', 1), else_=0)),
+            func.sum(case((and_(AuthenticationLog.result == 'success',
+                                AuthenticationLog.confidence_score < 0.5), 1), else_=0)),
+            func.sum(case((and_(AuthenticationLog.result == 'failed',
+                                AuthenticationLog.confidence_score >= 0.5), 1), else_=0))
+        ).filter(
             AuthenticationLog.confidence_score.isnot(None)
-        ).limit(1000).all()
+        ).one()
 
-        if not logs:
+        if not total:
             return jsonify([])
 
-        total = len(logs)
-        successful = sum(1 for l in logs if l.result == 'success')
-        false_accepts = sum(1 for l in logs if l.result == 'success' and l.confidence_score < 0.5)
-        false_rejects = sum(1 for l in logs if l.result == 'failed' and l.confidence_score >= 0.5)
-
         far = false_accepts / total
         frr = false_rejects / total
         accuracy = successful / total
@@ -292,29 +340,36 @@ def get_recent_activities():
 @analytics_bp.route('/analytics/biometric-metrics', methods=['GET'])
 def get_biometric_metrics():
     try:
-        models = MLModel.query.filter_by(is_active=True).all()
-        if not models:
-            return jsonify({'success': True, 'metrics': {}})
-
-        avg_far = sum(m.far or 0 for m in models) / len(models)
-        avg_frr = sum(m.frr or 0 for m in models) / len(models)
-        avg_acc = sum(m.accuracy or 0 for m in models) / len(models)
-        eer = (avg_far + avg_frr) / 2
-
-        return jsonify({
-            'success': True,
-            'metrics': {
-                'far': round(avg_far * 100, 2),
-                'frr': round(avg_frr * 100, 2),
-                'eer': round(eer * 100, 2),
-                'accuracy': round(avg_acc * 100, 2)
-            }
-        })
+        return cached_json_response('biometric-metrics', compute_biometric_metrics)
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def compute_biometric_metrics():
+    # Averaged in SQL; coalesce keeps missing values counting as 0 like before
+    model_count, avg_far, avg_frr, avg_acc = db.session.query(
+        func.count(),
+        func.avg(func.coalesce(MLModel.far, 0)),
+        func.avg(func.coalesce(MLModel.frr, 0)),
+        func.avg(func.coalesce(MLModel.accuracy, 0))
+    ).filter(MLModel.is_active == True).one()
+    if not model_count:
+        return {'success': True, 'metrics': {}}
+
+    eer = (avg_far + avg_frr) / 2
+
+    return {
+        'success': True,
+        'metrics': {
+            'far': round(avg_far * 100, 2),
+            'frr': round(avg_frr * 100, 2),
+            'eer': round(eer * 100, 2),
+            'accuracy': round(avg_acc * 100, 2)
+        }
+    }
+
+
 # ============================================================
 # 9) PER-USER METRICS (UPDATED — FAR/FRR/EER INCLUDED)
 # ============================================================
@@ -337,14 +392,22 @@ def get_per_user_metrics():
             MLModel, (User.id == MLModel.user_id) & (MLModel.is_active == True)
         ).order_by(User.id).all()
 
+        # Keystroke counts for every user and split in one grouped query
+        split_counts = defaultdict(dict)
+        for user_id, data_split, count in db.session.query(
+            KeystrokeData.user_id,
+            KeystrokeData.data_split,
+            func.count()
+        ).group_by(KeystrokeData.user_id, KeystrokeData.data_split).all():
+            split_counts[user_id][data_split] = count
+
         result = []
         for user_data in users_data:
+            user_splits = split_counts.get(user_data.id, {})
             # Check if user has a model
             has_model = user_data.accuracy is not None
 
             if has_model:
-                from src.models.user import KeystrokeData
-
                 far_pct = (user_data.far or 0) * 100
                 frr_pct = (user_data.frr or 0) * 100
                 eer = (far_pct + frr_pct) / 2
@@ -353,9 +416,9 @@ def get_per_user_metrics():
                 model_trained_at = user_data.created_at.isoformat() if user_data.created_at else None
 
                 # Get split counts for dataset users
-                train_count = KeystrokeData.query.filter_by(user_id=user_data.id, data_split='train').count()
-                val_count = KeystrokeData.query.filter_by(user_id=user_data.id, data_split='validation').count()
-                test_count = KeystrokeData.query.filter_by(user_id=user_data.id, data_split='test').count()
+                train_count = user_splits.get('train', 0)
+                val_count = user_splits.get('validation', 0)
+                test_count = user_splits.get('test', 0)
 
                 split_info = {
                     'train': train_count,
@@ -364,8 +427,7 @@ def get_per_user_metrics():
                 } if train_count > 0 else None
             else:
                 # User without model - count collected samples
-                from src.models.user import KeystrokeData
-                collected_samples = KeystrokeData.query.filter_by(user_id=user_data.id).count()
+                collected_samples = sum(user_splits.values())
 
                 far_pct = 0
                 frr_pct = 0
@@ -400,21 +462,237 @@ def get_per_user_metrics():
 # 10) EXPORT USER ANALYTICS (XLSX)
 # ============================================================
 
+EXPORT_BATCH_SIZE = 1000  # ORM rows fetched per round trip while streaming a sheet
+EXPORT_SPOOL_SIZE = 32 * 1024 * 1024  # finished workbooks larger than this go to a temp file
+# Confidence cut-offs for the log sheet's Risk Level: < 0.60 CRITICAL ... >= 0.70 LOW
+RISK_THRESHOLDS = (0.60, 0.65, 0.70)
+RISK_LEVELS = ('CRITICAL', 'HIGH', 'MEDIUM', 'LOW')
+EXPORT_SHEETS = (
+    '1_Forensic_Summary', '2_Authentication_Logs', '3_Model_Performance', '4_Security_Alerts',
+    '5_Devices', '6_Feature_Names', '7_Keystroke_Data'
+)
+
+
+def write_sheet(worksheet, headers, rows, empty_note=None):
+    """Write headers and rows to a worksheet one row at a time, returning the row count.
+
+    When there are no rows and empty_note is given, the sheet gets a single Note cell instead.
+    """
+    count = 0
+    for count, row in enumerate(rows, start=1):
+        if count == 1:
+            worksheet.write_row(0, 0, headers)
+        worksheet.write_row(count, 0, row)
+
+    if count == 0:
+        if empty_note:
+            worksheet.write_row(0, 0, ('Note',))
+            worksheet.write_row(1, 0, (empty_note,))
+        else:
+            worksheet.write_row(0, 0, headers)
+    return count
+
+
+def stream_rows(*columns, where, order_by):
+    """Yield result rows in EXPORT_BATCH_SIZE batches instead of loading them all"""
+    return db.session.execute(
+        select(*columns).where(where).order_by(order_by)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+
 @analytics_bp.route('/analytics/export-user/<int:user_id>', methods=['GET'])
 def export_user_xlsx(user_id):
+    output = workbook = None
     try:
         user = User.query.get(user_id)
         if not user:
             return jsonify({'success': False, 'error': 'User not found'}), 404
 
-        logs = AuthenticationLog.query.filter_by(user_id=user_id).order_by(AuthenticationLog.timestamp.desc()).all()
-        keystrokes = KeystrokeData.query.filter_by(user_id=user_id).order_by(KeystrokeData.timestamp.desc()).all()
         model = MLModel.query.filter_by(user_id=user_id, is_active=True).first()
-        alerts = SecurityAlert.query.filter_by(user_id=user_id).order_by(SecurityAlert.timestamp.desc()).all()
-        devices = UserDevice.query.filter_by(user_id=user_id).order_by(UserDevice.last_seen.desc()).all()
+        devices = stream_rows(
+            UserDevice.device_fingerprint, UserDevice.device_name, UserDevice.device_type, UserDevice.browser,
+            UserDevice.os, UserDevice.first_seen, UserDevice.last_seen, UserDevice.is_trusted,
+            where=UserDevice.user_id == user_id,
+            order_by=UserDevice.last_seen.desc()
+        ).all()
+
+        # Rows are written straight from the query results; constant_memory keeps only
+        # the current row of each sheet in memory (xlsxwriter ignores it under 'in_memory').
+        # The finished file spills to disk past EXPORT_SPOOL_SIZE and is streamed by send_file.
+        output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        workbook = xlsxwriter.Workbook(output, {
+            'constant_memory': True,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+        })
+        sheets = {name: workbook.add_worksheet(name) for name in EXPORT_SHEETS}
+
+        # ===== SHEET 2: DETAILED AUTHENTICATION LOGS =====
+        log_results = defaultdict(int)
+        agent_logins = defaultdict(int)  # lower-cased user agent -> log count
+
+        def log_rows():
+            for timestamp, result, confidence, session_id, ip_address, user_agent in stream_rows(
+                # Formatted by SQLite so each row needs no datetime work in Python
+                func.strftime('%Y-%m-%d %H:%M:%S', AuthenticationLog.timestamp),
+                AuthenticationLog.result, AuthenticationLog.confidence_score,
+                AuthenticationLog.session_id, AuthenticationLog.ip_address, AuthenticationLog.user_agent,
+                where=AuthenticationLog.user_id == user_id,
+                order_by=AuthenticationLog.timestamp.desc()
+            ):
+                log_results[result] += 1
+                if user_agent:
+                    agent_logins[user_agent.lower()] += 1
+
+                yield (
+                    timestamp or 'N/A',
+                    timestamp[:10] if timestamp else 'N/A',
+                    timestamp[11:] if timestamp else 'N/A',
+                    result.upper(),
+                    'GRANTED' if result == 'success' else 'DENIED',
+                    f"{confidence * 100:.2f}%" if confidence else 'N/A',
+                    round(confidence, 4) if confidence else 0,
+                    'Yes' if confidence and confidence >= 0.60 else 'No',
+                    RISK_LEVELS[bisect_right(RISK_THRESHOLDS, confidence)] if confidence else 'UNKNOWN',
+                    session_id if session_id else 'N/A',
+                    ip_address if ip_address else 'N/A',
+                    user_agent if user_agent else 'N/A'
+                )
+
+        write_sheet(sheets['2_Authentication_Logs'], (
+            'Timestamp', 'Date', 'Time', 'Result', 'Access Decision', 'Confidence Score', 'Confidence (Raw)',
+            'Threshold Met', 'Risk Level', 'Session ID', 'IP Address', 'User Agent'
+        ), log_rows())
 
-        # ===== SHEET 1: FORENSIC SUMMARY =====
-        summary_df = pd.DataFrame([{
+        # ===== SHEET 3: PERFORMANCE METRICS & MODEL COMPARISON =====
+        # ===== SHEET 6: FEATURE NAMES =====
+        if model and model.training_metadata:
+            metadata = decode_json(model.training_metadata)
+            if 'model_comparisons' in metadata:
+                # Format model comparisons with best model indicator
+                write_sheet(sheets['3_Model_Performance'], (
+                    'Algorithm', 'Accuracy', 'FAR (False Accept Rate)', 'FRR (False Reject Rate)',
+                    'EER (Equal Error Rate)', 'Training Samples', 'Test Samples', 'Selected as Best', 'Rank'
+                ), ((
+                    comp.get('algorithm', 'Unknown'),
+                    f"{comp.get('accuracy', 0):.2f}%",
+                    f"{comp.get('far', 0):.2f}%",
+                    f"{comp.get('frr', 0):.2f}%",
+                    f"{comp.get('eer', 0):.2f}%",
+                    comp.get('train_samples', 0),
+                    comp.get('test_samples', 0),
+                    ' YES' if comp.get('selected') else 'No',
+                    comp.get('rank', 'N/A')
+                ) for comp in metadata['model_comparisons']))
+            else:
+                write_sheet(sheets['3_Model_Performance'], (
+                    'Algorithm', 'Accuracy', 'FAR (False Accept Rate)', 'FRR (False Reject Rate)',
+                    'EER (Equal Error Rate)', 'Selected as Best', 'Note'
+                ), [(
+                    metadata.get('algorithm', 'Unknown'),
+                    f"{model.accuracy * 100:.2f}%" if model.accuracy else 'N/A',
+                    f"{model.far * 100:.2f}%" if model.far else 'N/A',
+                    f"{model.frr * 100:.2f}%" if model.frr else 'N/A',
+                    f"{((model.far + model.frr) / 2) * 100:.2f}%" if model.far and model.frr else 'N/A',
+                    ' YES',
+                    'Only one model trained'
+                )])
+
+            # Feature names
+            write_sheet(sheets['6_Feature_Names'], ('Feature Index', 'Feature Name', 'Category'), ((
+                i + 1,
+                name,
+                'Dwell Time' if i < 8 else 'Flight Time' if i < 16 else 'Pause Pattern'
+            ) for i, name in enumerate(metadata.get('feature_names', ()))), 'Feature names not available')
+        else:
+            write_sheet(sheets['3_Model_Performance'], (), (), 'No trained model available')
+            write_sheet(sheets['6_Feature_Names'], (), (), 'No trained model available')
+
+        # ===== SHEET 4: SECURITY ALERTS =====
+        alert_severities = defaultdict(int)
+
+        def alert_rows():
+            for row in stream_rows(
+                SecurityAlert.timestamp, SecurityAlert.severity, SecurityAlert.alert_type, SecurityAlert.title,
+                SecurityAlert.description, SecurityAlert.status, SecurityAlert.confidence_score,
+                SecurityAlert.resolved_at, SecurityAlert.resolved_by,
+                where=SecurityAlert.user_id == user_id,
+                order_by=SecurityAlert.timestamp.desc()
+            ):
+                alert_severities[row.severity] += 1
+                yield (
+                    row.timestamp.strftime('%Y-%m-%d %H:%M:%S') if row.timestamp else 'N/A',
+                    row.severity.upper(),
+                    row.alert_type,
+                    row.title,
+                    row.description,
+                    row.status.upper(),
+                    f"{row.confidence_score * 100:.2f}%" if row.confidence_score else 'N/A',
+                    row.resolved_at.strftime('%Y-%m-%d %H:%M:%S') if row.resolved_at else 'Not Resolved',
+                    row.resolved_by if row.resolved_by else 'N/A'
+                )
+
+        total_alerts = write_sheet(sheets['4_Security_Alerts'], (
+            'Timestamp', 'Severity', 'Type', 'Title', 'Description', 'Status', 'Confidence Score',
+            'Resolved At', 'Resolved By'
+        ), alert_rows(), 'No alerts recorded')
+
+        # ===== SHEET 5: REGISTERED DEVICES =====
+        # Matched against the distinct user agents rather than every log row, once per
+        # distinct device name (auto-registered devices mostly share 'Unknown')
+        logins_by_name = {}
+
+        def device_logins(device):
+            name = device.device_name.lower()
+            if name not in logins_by_name:
+                logins_by_name[name] = sum(count for agent, count in agent_logins.items() if name in agent)
+            return logins_by_name[name]
+
+        write_sheet(sheets['5_Devices'], (
+            'Device Fingerprint', 'Device Name', 'Device Type', 'Browser', 'OS', 'First Seen', 'Last Seen',
+            'Trusted', 'Total Logins'
+        ), ((
+            d.device_fingerprint,
+            d.device_name,
+            d.device_type,
+            d.browser,
+            d.os,
+            d.first_seen.strftime('%Y-%m-%d %H:%M:%S') if d.first_seen else 'N/A',
+            d.last_seen.strftime('%Y-%m-%d %H:%M:%S') if d.last_seen else 'N/A',
+            'Yes' if d.is_trusted else 'No',
+            device_logins(d)
+        ) for d in devices), 'No devices registered')
+
+        # ===== SHEET 7: KEYSTROKE SAMPLES (with features) =====
+        # The widest raw_features list sets the Feature_N columns before streaming the rows
+        features = KeystrokeData.keystroke_features
+        feature_count = db.session.query(func.max(case(
+            (func.json_valid(features), func.json_array_length(features, '$.raw_features'))
+        ))).filter(KeystrokeData.user_id == user_id).scalar() or 0
+
+        def keystroke_rows():
+            for timestamp, session_id, data_split, raw in stream_rows(
+                KeystrokeData.timestamp, KeystrokeData.session_id, KeystrokeData.data_split, features,
+                where=KeystrokeData.user_id == user_id,
+                order_by=KeystrokeData.timestamp.desc()
+            ):
+                values = []
+                # Parse features if available
+                if raw:
+                    try:
+                        values = list(decode_keystroke_features(raw).get('raw_features', []))
+                    except:
+                        pass
+                yield (timestamp, session_id, data_split or 'live', *values)
+
+        keystroke_count = write_sheet(
+            sheets['7_Keystroke_Data'],
+            ('Timestamp', 'Session', 'Data Split', *(f'Feature_{i + 1}' for i in range(feature_count))),
+            keystroke_rows(), 'No keystroke data'
+        )
+
+        # ===== SHEET 1: FORENSIC SUMMARY (counts gathered while streaming) =====
+        summary = {
             'User ID': user.id,
             'Name': user.name,
             'Email': user.email,
@@ -425,153 +703,40 @@ def export_user_xlsx(user_id):
             'Last Login': user.last_login.strftime('%Y-%m-%d %H:%M:%S') if user.last_login else 'Never',
             'Failed Attempts': user.failed_attempts,
             'Current Auth Score': f"{user.auth_score * 100:.2f}%" if user.auth_score else 'N/A',
-            'Total Logins': len([l for l in logs if l.result == 'success']),
-            'Failed Logins': len([l for l in logs if l.result == 'failed']),
-            'Total Alerts': len(alerts),
-            'Critical Alerts': len([a for a in alerts if a.severity == 'critical']),
-            'Keystroke Samples': len(keystrokes),
+            'Total Logins': log_results['success'],
+            'Failed Logins': log_results['failed'],
+            'Total Alerts': total_alerts,
+            'Critical Alerts': alert_severities['critical'],
+            'Keystroke Samples': keystroke_count,
             'Registered Devices': len(devices),
             'Model Trained': 'Yes' if model else 'No',
             'Model Version': model.model_version if model else 'N/A',
             'Model Accuracy': f"{model.accuracy * 100:.2f}%" if model and model.accuracy else 'N/A',
             'FAR': f"{model.far * 100:.2f}%" if model and model.far else 'N/A',
             'FRR': f"{model.frr * 100:.2f}%" if model and model.frr else 'N/A'
-        }])
-
-        # ===== SHEET 2: DETAILED AUTHENTICATION LOGS =====
-        logs_df = pd.DataFrame([{
-            'Timestamp': l.timestamp.strftime('%Y-%m-%d %H:%M:%S') if l.timestamp else 'N/A',
-            'Date': l.timestamp.strftime('%Y-%m-%d') if l.timestamp else 'N/A',
-            'Time': l.timestamp.strftime('%H:%M:%S') if l.timestamp else 'N/A',
-            'Result': l.result.upper(),
-            'Access Decision': 'GRANTED' if l.result == 'success' else 'DENIED',
-            'Confidence Score': f"{l.confidence_score * 100:.2f}%" if l.confidence_score else 'N/A',
-            'Confidence (Raw)': round(l.confidence_score, 4) if l.confidence_score else 0,
-            'Threshold Met': 'Yes' if l.confidence_score and l.confidence_score >= 0.60 else 'No',
-            'Risk Level': ('LOW' if l.confidence_score and l.confidence_score >= 0.70 else
-                          'MEDIUM' if l.confidence_score and l.confidence_score >= 0.65 else
-                          'HIGH' if l.confidence_score and l.confidence_score >= 0.60 else
-                          'CRITICAL') if l.confidence_score else 'UNKNOWN',
-            'Session ID': l.session_id if l.session_id else 'N/A',
-            'IP Address': l.ip_address if l.ip_address else 'N/A',
-            'User Agent': l.user_agent if l.user_agent else 'N/A'
-        } for l in logs])
-
-        # Keystrokes with features expanded
-        keystroke_records = []
-        for k in keystrokes:
-            record = {
-                'Timestamp': k.timestamp,
-                'Session': k.session_id,
-                'Data Split': k.data_split or 'live'
-            }
-            # Parse features if available
-            if k.keystroke_features:
-                try:
-                    features = json.loads(k.keystroke_features)
-                    if 'raw_features' in features:
-                        for idx, val in enumerate(features['raw_features']):
-                            record[f'Feature_{idx+1}'] = val
-                except:
-                    pass
-            keystroke_records.append(record)
-
-        kdf = pd.DataFrame(keystroke_records)
-
-        # ===== SHEET 3: PERFORMANCE METRICS & MODEL COMPARISON =====
-        if model and model.training_metadata:
-            metadata = json.loads(model.training_metadata)
-            if 'model_comparisons' in metadata:
-                # Format model comparisons with best model indicator
-                model_comparisons = []
-                for comp in metadata['model_comparisons']:
-                    model_comparisons.append({
-                        'Algorithm': comp.get('algorithm', 'Unknown'),
-                        'Accuracy': f"{comp.get('accuracy', 0):.2f}%",
-                        'FAR (False Accept Rate)': f"{comp.get('far', 0):.2f}%",
-                        'FRR (False Reject Rate)': f"{comp.get('frr', 0):.2f}%",
-                        'EER (Equal Error Rate)': f"{comp.get('eer', 0):.2f}%",
-                        'Training Samples': comp.get('train_samples', 0),
-                        'Test Samples': comp.get('test_samples', 0),
-                        'Selected as Best': ' YES' if comp.get('selected') else 'No',
-                        'Rank': comp.get('rank', 'N/A')
-                    })
-                model_comp_df = pd.DataFrame(model_comparisons)
-            else:
-                model_comp_df = pd.DataFrame([{
-                    'Algorithm': metadata.get('algorithm', 'Unknown'),
-                    'Accuracy': f"{model.accuracy * 100:.2f}%" if model.accuracy else 'N/A',
-                    'FAR (False Accept Rate)': f"{model.far * 100:.2f}%" if model.far else 'N/A',
-                    'FRR (False Reject Rate)': f"{model.frr * 100:.2f}%" if model.frr else 'N/A',
-                    'EER (Equal Error Rate)': f"{((model.far + model.frr) / 2) * 100:.2f}%" if model.far and model.frr else 'N/A',
-                    'Selected as Best': ' YES',
-                    'Note': 'Only one model trained'
-                }])
-
-            # Feature names
-            if 'feature_names' in metadata:
-                feature_df = pd.DataFrame({
-                    'Feature Index': range(1, len(metadata['feature_names']) + 1),
-                    'Feature Name': metadata['feature_names'],
-                    'Category': ['Dwell Time' if i < 8 else 'Flight Time' if i < 16 else 'Pause Pattern'
-                                for i in range(len(metadata['feature_names']))]
-                })
-            else:
-                feature_df = pd.DataFrame({'Note': ['Feature names not available']})
-        else:
-            model_comp_df = pd.DataFrame({'Note': ['No trained model available']})
-            feature_df = pd.DataFrame({'Note': ['No trained model available']})
-
-        # ===== SHEET 4: SECURITY ALERTS =====
-        alerts_df = pd.DataFrame([{
-            'Timestamp': a.timestamp.strftime('%Y-%m-%d %H:%M:%S') if a.timestamp else 'N/A',
-            'Severity': a.severity.upper(),
-            'Type': a.alert_type,
-            'Title': a.title,
-            'Description': a.description,
-            'Status': a.status.upper(),
-            'Confidence Score': f"{a.confidence_score * 100:.2f}%" if a.confidence_score else 'N/A',
-            'Resolved At': a.resolved_at.strftime('%Y-%m-%d %H:%M:%S') if a.resolved_at else 'Not Resolved',
-            'Resolved By': a.resolved_by if a.resolved_by else 'N/A'
-        } for a in alerts]) if alerts else pd.DataFrame({'Note': ['No alerts recorded']})
-
-        # ===== SHEET 5: REGISTERED DEVICES =====
-        devices_df = pd.DataFrame([{
-            'Device Fingerprint': d.device_fingerprint,
-            'Device Name': d.device_name,
-            'Device Type': d.device_type,
-            'Browser': d.browser,
-            'OS': d.os,
-            'First Seen': d.first_seen.strftime('%Y-%m-%d %H:%M:%S') if d.first_seen else 'N/A',
-            'Last Seen': d.last_seen.strftime('%Y-%m-%d %H:%M:%S') if d.last_seen else 'N/A',
-            'Trusted': 'Yes' if d.is_trusted else 'No',
-            'Total Logins': len([l for l in logs if l.user_agent and d.device_name.lower() in l.user_agent.lower()])
-        } for d in devices]) if devices else pd.DataFrame({'Note': ['No devices registered']})
-
-        # ===== SHEET 6: KEYSTROKE SAMPLES (with features) =====
-        # Keep existing keystroke_records logic
-        kdf = pd.DataFrame(keystroke_records) if keystroke_records else pd.DataFrame({'Note': ['No keystroke data']})
-
-        # Create Excel file with all sheets
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            summary_df.to_excel(writer, sheet_name="1_Forensic_Summary", index=False)
-            logs_df.to_excel(writer, sheet_name="2_Authentication_Logs", index=False)
-            model_comp_df.to_excel(writer, sheet_name="3_Model_Performance", index=False)
-            alerts_df.to_excel(writer, sheet_name="4_Security_Alerts", index=False)
-            devices_df.to_excel(writer, sheet_name="5_Devices", index=False)
-            feature_df.to_excel(writer, sheet_name="6_Feature_Names", index=False)
-            kdf.to_excel(writer, sheet_name="7_Keystroke_Data", index=False)
+        }
+        write_sheet(sheets['1_Forensic_Summary'], tuple(summary), [tuple(summary.values())])
 
+        workbook.close()
         output.seek(0)
 
         return send_file(
             output,
             as_attachment=True,
             download_name=f"user_{user_id}_analytics.xlsx",
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            max_age=0
         )
 
     except Exception as e:
+        # send_file only owns the spool on success; release it (and the
+        # workbook's per-sheet temp files) here on any failure
+        if workbook is not None:
+            try:
+                workbook.close()
+            except Exception:
+                pass
+        if output is not None:
+            output.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
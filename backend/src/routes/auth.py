@@ -6,32 +6,30 @@ from src.models.user import (
     SecurityAlert,
     KeystrokeData,
     MLModel,
-    SystemSettings,
-    db
+    db,
+    encode_keystroke_features
 )
-from src.utils.feature_extractor import extract_features
+from src.utils.feature_extractor import N_FEATURES, extract_features
+from src.utils.model_cache import predict_with_cache
+from src.utils.settings_cache import get_threshold
+from src.utils.write_queue import enqueue_insert
 from datetime import datetime, timedelta, timezone
 import json
-import pickle
 import numpy as np
+import threading
 import uuid
 
 auth_bp = Blueprint("auth", __name__)
 
+_feature_buffer = threading.local()  # per-thread (1, 21) float32 vector reused by login()
 
-def get_threshold(key, default_value):
-    """Get threshold from SystemSettings or use default."""
-    setting = SystemSettings.query.filter_by(key=key).first()
-    if setting:
-        return float(setting.value)
-    return default_value
 
-
-def _log_auth_attempt(user_id, success, method="keystroke", confidence=None, device_info=None, ip_address=None, user_agent=None):
-    """Log authentication attempt with device information."""
-    log = AuthenticationLog(
+def _log_auth_attempt(user_id, success, method="keystroke", confidence=None, device_info=None, ip_address=None, user_agent=None, timestamp=None):
+    """Log authentication attempt with device information (written in the background)."""
+    enqueue_insert(
+        AuthenticationLog,
         user_id=user_id,
-        timestamp=datetime.now(timezone.utc).replace(tzinfo=None),
+        timestamp=timestamp or datetime.now(timezone.utc).replace(tzinfo=None),
         result="success" if success else "failed",
         confidence_score=confidence,
         ip_address=ip_address or request.remote_addr,
@@ -39,41 +37,42 @@ def _log_auth_attempt(user_id, success, method="keystroke", confidence=None, dev
         device_fingerprint=device_info.get('device_id') if device_info else None,
         location=None  # Can be populated with geolocation API
     )
-    db.session.add(log)
 
 
-def _create_alert(user_id, title, desc, severity):
-    """Create security alert."""
-    alert = SecurityAlert(
+def _create_alert(user_id, title, desc, severity, timestamp=None):
+    """Create security alert (written in the background)."""
+    enqueue_insert(
+        SecurityAlert,
         user_id=user_id,
         alert_type="anomaly",
         severity=severity,
         title=title,
         description=desc,
-        timestamp=datetime.now(timezone.utc).replace(tzinfo=None)
+        timestamp=timestamp or datetime.now(timezone.utc).replace(tzinfo=None)
     )
-    db.session.add(alert)
 
 
 def _failed_login(email):
     """Handle failed login attempt."""
     user = User.query.filter_by(email=email).first()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
     
     if user:
         user.failed_attempts += 1
         if user.failed_attempts >= 3:
             user.status = "locked"
-            user.locked_until = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=30)
+            user.locked_until = now + timedelta(minutes=30)
             _create_alert(
                 user.id,
                 title="Account Locked",
                 desc="3 failed password attempts",
-                severity="high"
+                severity="high",
+                timestamp=now
             )
         db.session.commit()
     
     if user:
-        _log_auth_attempt(user.id, success=False, method="password", device_info=None, ip_address=request.remote_addr, user_agent=request.headers.get('User-Agent'))
+        _log_auth_attempt(user.id, success=False, method="password", device_info=None, ip_address=request.remote_addr, user_agent=request.headers.get('User-Agent'), timestamp=now)
 
     return jsonify({"error": "Invalid email or password"}), 401
 
@@ -105,6 +104,10 @@ def login():
         JSON response with authentication result
     """
     try:
+        # One clock read for every timestamp written by this login
+        now_utc = datetime.now(timezone.utc)
+        now = now_utc.replace(tzinfo=None)
+
         data = request.json or {}
         email = data.get("email", "").strip().lower()
         password = data.get("password", "")
@@ -123,7 +126,7 @@ def login():
 
         # Check account status
         if user.status == "locked" and user.locked_until:
-            if datetime.now(timezone.utc).replace(tzinfo=None) < user.locked_until:
+            if now < user.locked_until:
                 return jsonify({
                     "error": "Account locked",
                     "locked_until": user.locked_until.isoformat()
@@ -132,7 +135,6 @@ def login():
                 user.status = "active"
                 user.locked_until = None
                 user.failed_attempts = 0
-                db.session.commit()
 
         # Device tracking
         device_id = device_info.get("device_id", "unknown-device")
@@ -155,17 +157,16 @@ def login():
             db.session.add(device)
             is_new_device = True
         else:
-            device.last_seen = datetime.now(timezone.utc).replace(tzinfo=None)
+            device.last_seen = now
 
-        db.session.commit()
+        # Writes below are committed once per exit path rather than step by step
 
         # Handle password-only login (no keystroke data)
         if not keystroke_data:
-            user.last_login = datetime.now(timezone.utc).replace(tzinfo=None)
+            user.last_login = now
             user.failed_attempts = 0
-            db.session.commit()
 
-            _log_auth_attempt(user.id, success=True, method="password_only", device_info=device_info, ip_address=request.remote_addr, user_agent=request.headers.get('User-Agent'))
+            _log_auth_attempt(user.id, success=True, method="password_only", device_info=device_info, ip_address=request.remote_addr, user_agent=request.headers.get('User-Agent'), timestamp=now)
             db.session.commit()
             
             return jsonify({
@@ -180,37 +181,35 @@ def login():
         # Collect keystroke data for training
         keystroke_record = KeystrokeData(
             user_id=user.id,
-            session_id=f"login_{datetime.now(timezone.utc).timestamp()}",
-            keystroke_features=json.dumps(keystroke_data),
+            session_id=f"login_{now_utc.timestamp()}",
+            keystroke_features=encode_keystroke_features(keystroke_data),
             device_info=json.dumps(device_info),
             is_training_data=True,
             anomaly_score=0.0,
             data_split=None
         )
         db.session.add(keystroke_record)
-        db.session.commit()
 
         sample_count = KeystrokeData.query.filter_by(user_id=user.id).count()
 
         # Extract keystroke features
         try:
-            features = extract_features(keystroke_data)
-            if not features or len(features) != 21:
-                return jsonify({
-                    "error": f"Feature extraction error: got {len(features) if features else 0} features, expected 21"
-                }), 400
-            features = np.array(features, dtype=np.float32)
+            buf = getattr(_feature_buffer, 'x', None)
+            if buf is None:
+                buf = _feature_buffer.x = np.empty((1, N_FEATURES), dtype=np.float32)
+            features = extract_features(keystroke_data, out=buf[0])
+            keystroke_record.feature_vector = features.tobytes()  # saved so training skips re-extraction
         except Exception as e:
+            db.session.commit()  # keep the device and raw sample as before
             return jsonify({"error": f"Feature extraction failed: {str(e)}"}), 400
 
-        # Load user's ML model
+        # Load user's ML model (its stored blobs are deferred; load_model_package() reads them on a cache miss)
         ml_model = MLModel.query.filter_by(user_id=user.id, is_active=True).first()
         if not ml_model:
-            user.last_login = datetime.now(timezone.utc).replace(tzinfo=None)
+            user.last_login = now
             user.failed_attempts = 0
-            db.session.commit()
 
-            _log_auth_attempt(user.id, success=True, method="keystroke_no_model", device_info=device_info, ip_address=request.remote_addr, user_agent=request.headers.get('User-Agent'))
+            _log_auth_attempt(user.id, success=True, method="keystroke_no_model", device_info=device_info, ip_address=request.remote_addr, user_agent=request.headers.get('User-Agent'), timestamp=now)
             db.session.commit()
 
             model_ready = sample_count >= 280
@@ -230,32 +229,10 @@ def login():
 
         # Perform model prediction
         try:
-            # Load model package (includes scaler if available)
-            model_package = pickle.loads(ml_model.model_data)
-
-            # Handle both old models (just model) and new models (model + scaler)
-            if isinstance(model_package, dict):
-                model = model_package['model']
-                scaler = model_package.get('scaler', None)
-            else:
-                model = model_package  # Old model format
-                scaler = None
-
-            X = features.reshape(1, -1)
-
-            # Apply scaling if scaler is available (new models)
-            if scaler is not None:
-                X = scaler.transform(X)
-
-            prediction = model.predict(X)[0]
+            # Scaled + predicted with the cached model; repeats within a minute skip sklearn
+            prediction, confidence = predict_with_cache(ml_model.id, ml_model.model_version, features)
             is_genuine = prediction == 1
 
-            try:
-                proba = model.predict_proba(X)[0]
-                confidence = float(proba[-1])
-            except:
-                confidence = 0.95 if is_genuine else 0.15
-
             # Get dynamic thresholds from system settings
             anomaly_threshold = get_threshold('anomaly_threshold', 0.85)  # Default 85%
             far_threshold = get_threshold('far_threshold', 0.05)  # Default 5%
@@ -268,10 +245,11 @@ def login():
             access_denied = confidence < access_denied_threshold
 
         except Exception as e:
+            db.session.commit()  # keep the device and raw sample as before
             return jsonify({"error": f"Model prediction failed: {str(e)}"}), 500
 
         # Log authentication attempt
-        _log_auth_attempt(user.id, success=(not access_denied), confidence=confidence, device_info=device_info, ip_address=request.remote_addr, user_agent=request.headers.get('User-Agent'))
+        _log_auth_attempt(user.id, success=(not access_denied), confidence=confidence, device_info=device_info, ip_address=request.remote_addr, user_agent=request.headers.get('User-Agent'), timestamp=now)
 
         # Create security alerts if needed
         if access_denied:
@@ -280,7 +258,8 @@ def login():
                 user.id,
                 title="IMPERSONATION ATTEMPT DETECTED",
                 desc=f"Access DENIED. Confidence score: {confidence:.2%}. Behavioral pattern does not match legitimate user profile. Possible impersonation attempt.",
-                severity=severity
+                severity=severity,
+                timestamp=now
             )
         elif anomaly:
             severity = "high" if confidence < 0.65 else "medium"
@@ -288,7 +267,8 @@ def login():
                 user.id,
                 title="Suspicious Keystroke Pattern Detected",
                 desc=f"Confidence score: {confidence:.2%}. Pattern differs from baseline but access granted.",
-                severity=severity
+                severity=severity,
+                timestamp=now
             )
 
         if is_new_device:
@@ -296,7 +276,8 @@ def login():
                 user.id,
                 title="New Device Detected",
                 desc=f"Login from new device: {device_info.get('device_name', 'Unknown')}",
-                severity="low"
+                severity="low",
+                timestamp=now
             )
 
         # Update user status
@@ -305,29 +286,31 @@ def login():
             user.failed_attempts += 1
             if user.failed_attempts >= 3:
                 user.status = "locked"
-                user.locked_until = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=30)
+                user.locked_until = now + timedelta(minutes=30)
                 _create_alert(
                     user.id,
                     title="Account Locked",
                     desc="3 consecutive impersonation attempts detected",
-                    severity="critical"
+                    severity="critical",
+                    timestamp=now
                 )
         elif is_genuine and not anomaly:
             user.failed_attempts = 0
-            user.last_login = datetime.now(timezone.utc).replace(tzinfo=None)
+            user.last_login = now
         elif is_genuine and anomaly:
             user.failed_attempts = 0
-            user.last_login = datetime.now(timezone.utc).replace(tzinfo=None)
+            user.last_login = now
         else:
             user.failed_attempts += 1
             if user.failed_attempts >= 3:
                 user.status = "locked"
-                user.locked_until = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=30)
+                user.locked_until = now + timedelta(minutes=30)
                 _create_alert(
                     user.id,
                     title="Account Locked",
                     desc="3 consecutive authentication failures detected",
-                    severity="critical"
+                    severity="critical",
+                    timestamp=now
                 )
 
         db.session.commit()
@@ -1,20 +1,56 @@
 # ================================================================
 #  BioAuthAI — Dataset Import / Export / Stats Module
 # Stores RAW keystroke data (dwell_times, flight_times, etc.)
-# Feature extraction happens during ML training for flexibility
+# Raw data stays the source of truth; the extracted vector is stored alongside
 # Author: Sharifa Al-Kaabi ️
 # ================================================================
 
-from flask import Blueprint, request, jsonify
-from src.models.user import db, User, KeystrokeData
-from src.utils.feature_extractor import extract_features  #  NEW FEATURE ENGINE
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from src.models.user import db, User, KeystrokeData, encode_keystroke_features
+from src.utils.feature_extractor import N_FEATURES, extract_features  #  NEW FEATURE ENGINE
 from datetime import datetime
 import json
 import csv
 import io
+import itertools
+import numpy as np
 
 dataset_bp = Blueprint('dataset', __name__)
 
+IMPORT_BATCH_SIZE = 1000  # keystroke rows per bulk INSERT during import
+
+
+def _validate_keystroke_shape(raw_k):
+    """Reject nested timing lists, which extract_features() would flatten without complaint."""
+    for field in ("dwell_times", "flight_times", "pause_patterns"):
+        if any(isinstance(v, (list, tuple, dict)) for v in raw_k.get(field) or ()):
+            raise ValueError(f"{field} must be a flat list of numbers")
+
+
+def _resolve_import_users(rows):
+    """Map the emails and user ids referenced by a batch of rows with one IN (...) query each."""
+    emails = {row["user_email"] for row in rows if row.get("user_email")}
+    user_ids = set()
+    for row in rows:
+        try:
+            user_ids.add(int(row["user_id"]))
+        except (KeyError, TypeError, ValueError):
+            pass
+    ids_by_email = dict(
+        db.session.query(User.email, User.id).filter(User.email.in_(emails))
+    ) if emails else {}
+    known_ids = {
+        uid for (uid,) in db.session.query(User.id).filter(User.id.in_(user_ids))
+    } if user_ids else set()
+    return ids_by_email, known_ids
+
+
+class _EchoBuffer:
+    """File-like sink for csv.writer: writerow() returns the formatted line."""
+
+    def write(self, value):
+        return value
+
 
 # ================================================================
 # 1. IMPORT DATASET (CSV) — AUTO FEATURE EXTRACTION
@@ -30,8 +66,8 @@ def import_dataset():
         B) Raw single key lines:
            user_email, key, dwell_time, flight_time, timestamp
 
-    Stores raw keystroke data (not extracted features).
-    Feature extraction happens during ML training for maximum flexibility.
+    Stores raw keystroke data plus its extracted feature vector, so
+    training never has to extract (or write back) imported rows.
     """
 
     try:
@@ -42,84 +78,104 @@ def import_dataset():
         if not file.filename.endswith('.csv'):
             return jsonify({'error': 'Only CSV files are supported'}), 400
 
-        # Read CSV content
-        stream = io.StringIO(file.stream.read().decode("UTF-8"))
-        csv_reader = csv.DictReader(stream)
+        # Parse the upload as it is read, one batch of rows at a time
+        reader = csv.DictReader(io.TextIOWrapper(file.stream, encoding="utf-8", newline=""))
 
         imported = 0
         errors = []
-
-        for row_num, row in enumerate(csv_reader, start=2):
-            try:
-                # ------------------------------------------------------------
-                # 1️⃣ Lookup user
-                # ------------------------------------------------------------
-                user = None
-                if "user_email" in row:
-                    user = User.query.filter_by(email=row["user_email"]).first()
-                elif "user_id" in row:
-                    user = User.query.get(int(row["user_id"]))
-
-                if not user:
-                    errors.append(f"Row {row_num}: User not found")
-                    continue
-
-                # ------------------------------------------------------------
-                # 2️⃣ Parse keystroke raw data
-                # ------------------------------------------------------------
-                if "dwell_times" in row:
-                    # Aggregated CSV with JSON arrays
-                    raw_k = {
-                        "dwell_times": json.loads(row["dwell_times"]),
-                        "flight_times": json.loads(row.get("flight_times", "[]")),
-                        "pause_patterns": json.loads(row.get("pause_patterns", "[]")),
-                        "typing_speed": float(row.get("typing_speed", 0.0)),
-                        "total_keys": len(json.loads(row["dwell_times"])),
-                    }
-
-                elif "dwell_time" in row:
-                    # Individual key rows (rare case)
-                    raw_k = {
-                        "dwell_times": [float(row.get("dwell_time", 0))],
-                        "flight_times": [float(row.get("flight_time", 0))],
-                        "pause_patterns": [],
-                        "typing_speed": 0,
-                        "total_keys": 1,
-                    }
-
-                else:
-                    errors.append(f"Row {row_num}: No keystroke fields found")
-                    continue
-
-                # ------------------------------------------------------------
-                # 3️⃣ Validate raw keystroke data (feature extraction happens during training)
-                # ------------------------------------------------------------
-                # Quick validation that extract_features will work later
-                test_features = extract_features(raw_k)
-                if test_features is None:
-                    errors.append(f"Row {row_num}: Invalid keystroke data format")
-                    continue
-
-                # ------------------------------------------------------------
-                # 4️⃣ Save RAW keystroke data to database (NOT extracted features)
-                # ------------------------------------------------------------
-                keystroke = KeystrokeData(
-                    user_id=user.id,
-                    session_id=row.get("session_id", f"import_{datetime.utcnow().timestamp()}"),
-                    keystroke_features=json.dumps(raw_k),   # STORE RAW DATA, extract features during training
-                    device_info=json.dumps({
-                        "source": "csv_import",
-                        "imported_at": datetime.utcnow().isoformat()
-                    }),
-                    is_training_data=True,
-                    anomaly_score=None,
-                )
-
-                db.session.add(keystroke)
-                imported += 1
-
-            except Exception as e:
-                errors.append(f"Row {row_num}: {str(e)}")
+        pending = []  # row mappings for the next bulk insert
+        next_row = 2  # CSV line number of the next data row
+
+        while True:
+            rows = list(itertools.islice(reader, IMPORT_BATCH_SIZE))
+            if not rows:
+                break
+            ids_by_email, known_ids = _resolve_import_users(rows)
+
+            for row_num, row in enumerate(rows, start=next_row):
+                try:
+                    # ------------------------------------------------------------
+                    # 1️⃣ Lookup user
+                    # ------------------------------------------------------------
+                    user_id = None
+                    if "user_email" in row:
+                        user_id = ids_by_email.get(row["user_email"])
+                    elif "user_id" in row:
+                        user_id = int(row["user_id"])
+                        if user_id not in known_ids:
+                            user_id = None
+
+                    if user_id is None:
+                        errors.append(f"Row {row_num}: User not found")
+                        continue
+
+                    # ------------------------------------------------------------
+                    # 2️⃣ Parse keystroke raw data
+                    # ------------------------------------------------------------
+                    if "dwell_times" in row:
+                        # Aggregated CSV with JSON arrays
+                        raw_k = {
+                            "dwell_times": json.loads(row["dwell_times"]),
+                            "flight_times": json.loads(row.get("flight_times", "[]")),
+                            "pause_patterns": json.loads(row.get("pause_patterns", "[]")),
+                            "typing_speed": float(row.get("typing_speed", 0.0)),
+                            "total_keys": len(json.loads(row["dwell_times"])),
+                        }
+
+                    elif "dwell_time" in row:
+                        # Individual key rows (rare case)
+                        raw_k = {
+                            "dwell_times": [float(row.get("dwell_time", 0))],
+                            "flight_times": [float(row.get("flight_time", 0))],
+                            "pause_patterns": [],
+                            "typing_speed": 0,
+                            "total_keys": 1,
+                        }
+
+                    else:
+                        errors.append(f"Row {row_num}: No keystroke fields found")
+                        continue
+
+                    # ------------------------------------------------------------
+                    # 3️⃣ Validate raw keystroke data by extracting its features
+                    # ------------------------------------------------------------
+                    # Every row is extracted for its stored vector, which doubles
+                    # as the full validation; extraction errors are reported
+                    # per row by the handler below. The shape check only covers
+                    # what extraction misses: it flattens nested lists silently.
+                    _validate_keystroke_shape(raw_k)
+                    features = extract_features(raw_k, out=np.empty(N_FEATURES, dtype=np.float32))
+                    if features is None:
+                        errors.append(f"Row {row_num}: Invalid keystroke data format")
+                        continue
+                    feature_vector = features.tobytes()
+
+                    # ------------------------------------------------------------
+                    # 4️⃣ Save RAW keystroke data to database, with its feature vector
+                    # ------------------------------------------------------------
+                    pending.append(dict(
+                        user_id=user_id,
+                        session_id=row.get("session_id", f"import_{datetime.utcnow().timestamp()}"),
+                        keystroke_features=encode_keystroke_features(raw_k),   # STORE RAW DATA
+                        feature_vector=feature_vector,
+                        device_info=json.dumps({
+                            "source": "csv_import",
+                            "imported_at": datetime.utcnow().isoformat()
+                        }),
+                        is_training_data=True,
+                        anomaly_score=None,
+                    ))
+                    imported += 1
+
+                except Exception as e:
+                    errors.append(f"Row {row_num}: {str(e)}")
+
+            next_row += len(rows)
+
+            # Plain INSERTs skip per-object unit-of-work tracking
+            if pending:
+                db.session.bulk_insert_mappings(KeystrokeData, pending)
+                pending.clear()
 
         db.session.commit()
 
@@ -147,41 +203,41 @@ def export_dataset():
         user_id = request.args.get("user_id", type=int)
         include_training = request.args.get("include_training", "true").lower() == "true"
 
-        query = KeystrokeData.query
+        # One joined statement for the whole export instead of a User lookup per row
+        query = db.session.query(
+            KeystrokeData.user_id,
+            User.email,
+            KeystrokeData.session_id,
+            KeystrokeData.timestamp,
+            KeystrokeData.keystroke_features,
+            KeystrokeData.is_training_data,
+        ).outerjoin(User, User.id == KeystrokeData.user_id)
         if user_id:
-            query = query.filter_by(user_id=user_id)
+            query = query.filter(KeystrokeData.user_id == user_id)
         if include_training:
-            query = query.filter_by(is_training_data=True)
-
-        records = query.all()
-
-        # Prepare CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        # Header
-        writer.writerow([
-            "user_id", "email", "session_id", "timestamp",
-            "features_json", "is_training"
-        ])
-
-        for rec in records:
-            user = User.query.get(rec.user_id)
-            writer.writerow([
-                rec.user_id,
-                user.email if user else "",
-                rec.session_id,
-                rec.timestamp.isoformat(),
-                rec.keystroke_features,
-                rec.is_training_data,
-            ])
+            query = query.filter(KeystrokeData.is_training_data == True)
 
-        output.seek(0)
+        # Stream the CSV row by row as yield_per fetches it
+        writer = csv.writer(_EchoBuffer())
 
-        return output.getvalue(), 200, {
-            "Content-Type": "text/csv",
+        def generate():
+            yield writer.writerow([
+                "user_id", "email", "session_id", "timestamp",
+                "features_json", "is_training"
+            ])
+            for rec in query.yield_per(1000):
+                yield writer.writerow([
+                    rec.user_id,
+                    rec.email or "",
+                    rec.session_id,
+                    rec.timestamp.isoformat(),
+                    rec.keystroke_features,
+                    rec.is_training_data,
+                ])
+
+        return Response(stream_with_context(generate()), mimetype="text/csv", headers={
             "Content-Disposition": f'attachment; filename=bioauthai_features_{datetime.utcnow().strftime("%Y%m%d")}.csv'
-        }
+        })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -195,24 +251,29 @@ def export_dataset():
 def dataset_stats():
     """Return dataset summary with sample counts per user."""
     try:
-        total = KeystrokeData.query.count()
-        training = KeystrokeData.query.filter_by(is_training_data=True).count()
-
-        users = (
+        # One grouped pass gives per-user counts and, summed, the totals.
+        # Outer join so samples of deleted users still count towards the totals.
+        rows = (
             db.session.query(
-                User.id,
+                KeystrokeData.user_id,
                 User.email,
-                db.func.count(KeystrokeData.id).label("samples")
+                db.func.count(KeystrokeData.id).label("samples"),
+                db.func.count(KeystrokeData.id).filter(KeystrokeData.is_training_data == True).label("training"),
             )
-            .join(KeystrokeData)
-            .group_by(User.id)
+            .outerjoin(User, User.id == KeystrokeData.user_id)
+            .group_by(KeystrokeData.user_id)
             .all()
         )
 
+        total = sum(r.samples for r in rows)
+        training = sum(r.training for r in rows)
+
         per_user = []
-        for u in users:
+        for u in rows:
+            if u.email is None:
+                continue
             per_user.append({
-                "user_id": u.id,
+                "user_id": u.user_id,
                 "email": u.email,
                 "samples": u.samples,
             })
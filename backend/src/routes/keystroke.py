@@ -15,11 +15,12 @@
 
 from flask import Blueprint, jsonify, request
 from datetime import datetime
-from src.models.user import db, User, KeystrokeData, MLModel
-from src.utils.feature_extractor import extract_features
+from src.models.user import db, User, KeystrokeData, MLModel, decode_keystroke_features, encode_keystroke_features
+from src.utils.feature_extractor import extract_features, feature_vector_bytes
+from src.utils.model_cache import load_model_package
+from src.utils.write_queue import enqueue_update
 import numpy as np
 import json
-import pickle
 
 
 keystroke_bp = Blueprint("keystroke", __name__)
@@ -42,7 +43,7 @@ def get_all_keystrokes():
         output = []
         for r in records:
             try:
-                feats = json.loads(r.keystroke_features or "{}")
+                feats = decode_keystroke_features(r.keystroke_features)
             except:
                 feats = {}
 
@@ -94,7 +95,8 @@ def capture_keystroke_data():
         ks = KeystrokeData(
             user_id=user_id,
             session_id=session_id,
-            keystroke_features=json.dumps(features),
+            keystroke_features=encode_keystroke_features(features),
+            feature_vector=feature_vector_bytes(features),
             device_info=json.dumps(device_info),
             is_training_data=is_training,
             anomaly_score=None
@@ -138,8 +140,12 @@ def analyze_keystroke():
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        # Load model
-        model_rec = MLModel.query.filter_by(user_id=user_id, is_active=True).first()
+        # Only the id and version are needed to find the cached model
+        model_rec = (
+            db.session.query(MLModel.id, MLModel.model_version)
+            .filter_by(user_id=user_id, is_active=True)
+            .first()
+        )
         if not model_rec:
             return jsonify({
                 "requires_training": True,
@@ -147,16 +153,8 @@ def analyze_keystroke():
                 "authenticated": None
             }), 200
 
-        # Load model package (includes scaler if available)
-        model_package = pickle.loads(model_rec.model_data)
-
-        # Handle both old models (just model) and new models (model + scaler)
-        if isinstance(model_package, dict):
-            model = model_package['model']
-            scaler = model_package.get('scaler', None)
-        else:
-            model = model_package  # Old model format
-            scaler = None
+        # Load model package (includes scaler if available), deserialized once per process
+        model, scaler = load_model_package(model_rec.id, model_rec.model_version)
 
         # Extract 21 features
         fv = extract_features(features)
@@ -176,17 +174,16 @@ def analyze_keystroke():
             authenticated = True
             confidence = 0.85
 
-        # Save anomaly score into last keystroke event
+        # Save anomaly score into last keystroke event, off the response path
         last = (
-            KeystrokeData.query
+            db.session.query(KeystrokeData.id)
             .filter_by(user_id=user_id)
             .order_by(KeystrokeData.timestamp.desc())
             .first()
         )
 
         if last:
-            last.anomaly_score = float(confidence)
-            db.session.commit()
+            enqueue_update(KeystrokeData, last.id, anomaly_score=float(confidence))
 
         return jsonify({
             "authenticated": authenticated,
@@ -259,6 +256,7 @@ def batch_process():
 
         processed = 0
         results = []
+        rows = []  # mappings for one bulk insert
 
         for item in batch:
             try:
@@ -269,13 +267,13 @@ def batch_process():
                 if not user_id or not session_id:
                     continue
 
-                ks = KeystrokeData(
+                rows.append(dict(
                     user_id=user_id,
                     session_id=session_id,
-                    keystroke_features=json.dumps(feats),
+                    keystroke_features=encode_keystroke_features(feats),
+                    feature_vector=feature_vector_bytes(feats),
                     is_training_data=item.get("is_training", True)
-                )
-                db.session.add(ks)
+                ))
                 processed += 1
 
                 results.append({
@@ -292,6 +290,9 @@ def batch_process():
                     "error": str(e)
                 })
 
+        # One executemany INSERT instead of an ORM flush per sample
+        if rows:
+            db.session.bulk_insert_mappings(KeystrokeData, rows)
         db.session.commit()
 
         return jsonify({
@@ -11,29 +11,137 @@
 # Stores best model + scaler into MLModel table
 # ======================================================================
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
+from joblib import Parallel, cpu_count, delayed
 from datetime import datetime
 import numpy as np
+from sqlalchemy import bindparam, func
+import copy
 import json
-import pickle
 
 from sklearn.svm import OneClassSVM
-from sklearn.ensemble import IsolationForest, RandomForestClassifier, GradientBoostingClassifier
+from sklearn.ensemble import IsolationForest, RandomForestClassifier, HistGradientBoostingClassifier
 from sklearn.neural_network import MLPClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 
-from src.models.user import db, User, KeystrokeData, MLModel
-from src.utils.feature_extractor import extract_features
+from src.models.user import db, User, KeystrokeData, MLModel, decode_keystroke_features
+from src.utils.feature_extractor import N_FEATURES, extract_features
+from src.utils.model_cache import delete_model_files, load_model_package, retire_active_models, save_model_package
 
 
 ml_bp = Blueprint("ml_training", __name__)
 
+TRAIN_ALL_JOBS = -1  # users trained at once by /ml/train-all (-1: one thread per core)
+MLP_LAYERS = (64, 32, 16)
+WARM_START_MAX_GROWTH = 0.25  # retrain the MLP from scratch once samples grow by more than this
+WARM_START_MAX_ITER = 100  # epochs for a warm-started MLP (a fresh fit gets up to 800)
+
+
+
+def _feature_matrix(rows):
+    """
+    Stack the 21 features of each (id, keystroke_features, feature_vector)
+    row into one float32 matrix. Stored vectors are copied as-is; rows saved
+    without one (older data) are extracted here and their vector written back.
+    """
+    X = np.empty((len(rows), N_FEATURES), dtype=np.float32)
+    backfill = []
+    for i, (row_id, raw, vector) in enumerate(rows):
+        if vector is not None:
+            X[i] = np.frombuffer(vector, dtype=np.float32)
+        else:
+            extract_features(decode_keystroke_features(raw), out=X[i])
+            backfill.append({"row_id": row_id, "vector": X[i].tobytes()})
+    if backfill:
+        _store_feature_vectors(backfill)
+    return X
+
+
+def _store_feature_vectors(backfill):
+    """
+    Write backfilled vectors in their own short transaction on a separate
+    connection, so the SQLite write lock is never held while models fit.
+    """
+    table = KeystrokeData.__table__
+    stmt = (
+        table.update()
+        .where(table.c.id == bindparam("row_id"))
+        .values(feature_vector=bindparam("vector"))
+    )
+    with db.engine.begin() as conn:
+        conn.execute(stmt, backfill)
+
+
+_FEATURE_COLUMNS = (KeystrokeData.id, KeystrokeData.keystroke_features, KeystrokeData.feature_vector)
+
+
+def _user_feature_rows(user_id, **filters):
+    """Only the feature columns of a user's samples."""
+    return db.session.query(*_FEATURE_COLUMNS).filter_by(user_id=user_id, **filters).all()
+
+
+def _impostor_feature_rows(other_user_ids, data_split, per_user, total):
+    """
+    Feature columns of the first `per_user` samples of each user in
+    `other_user_ids`, in user order and capped at `total` rows, fetched
+    with one windowed query instead of one query per user.
+    """
+    if not other_user_ids:
+        return []
+    ranked = (
+        db.session.query(
+            KeystrokeData.id,
+            KeystrokeData.user_id,
+            KeystrokeData.keystroke_features,
+            KeystrokeData.feature_vector,
+            func.row_number().over(
+                partition_by=KeystrokeData.user_id, order_by=KeystrokeData.id
+            ).label("rn"),
+        )
+        .filter(KeystrokeData.user_id.in_(other_user_ids), KeystrokeData.data_split == data_split)
+        .subquery()
+    )
+    return (
+        db.session.query(ranked.c.id, ranked.c.keystroke_features, ranked.c.feature_vector)
+        .filter(ranked.c.rn <= per_user)
+        .order_by(ranked.c.user_id, ranked.c.id)
+        .limit(total)
+        .all()
+    )
+
+
+def _warm_start_mlp(user_id, total_samples):
+    """
+    (mlp, scaler) to continue from the user's active MLPClassifier: a copy of
+    it set to warm-start for WARM_START_MAX_ITER epochs, and the scaler its
+    weights were learned on, to be reused for this run. (None, None) when it
+    should be fitted from scratch (no previous MLP or scaler, different shape,
+    or too many samples added since it was trained).
+    """
+    prev = (
+        db.session.query(MLModel.id, MLModel.model_version, MLModel.training_data_count)
+        .filter_by(user_id=user_id, is_active=True)
+        .first()
+    )
+    if prev is None or not prev.model_version.startswith("MLPClassifier_"):
+        return None, None
+    if not prev.training_data_count <= total_samples <= prev.training_data_count * (1 + WARM_START_MAX_GROWTH):
+        return None, None
+
+    model, scaler = load_model_package(prev.id, prev.model_version)
+    if scaler is None or tuple(model.hidden_layer_sizes) != MLP_LAYERS or model.n_features_in_ != N_FEATURES:
+        return None, None
+
+    # The cached model is shared with login and memory-mapped read-only
+    mlp = copy.deepcopy(model)
+    mlp.set_params(warm_start=True, max_iter=WARM_START_MAX_ITER)
+    return mlp, scaler
 
 
 #  METRIC CALCULATIONS (WITH CROSS-USER IMPOSTOR TESTING)
 
-def compute_metrics(model, X_test, X_train, user_id):
+def compute_metrics(model, X_test, X_train, user_id, rng):
     """
     Realistic evaluation using OTHER USERS as impostors.
 
@@ -42,6 +150,7 @@ def compute_metrics(model, X_test, X_train, user_id):
         X_test: Test samples from the genuine user (numpy array)
         X_train: Training samples from the genuine user (numpy array)
         user_id: ID of the user being evaluated
+        rng: np.random.RandomState owned by the caller, for the simulated-impostor fallback
 
     Returns:
         tuple: (accuracy, far, frr, confusion_matrix_dict)
@@ -67,34 +176,20 @@ def compute_metrics(model, X_test, X_train, user_id):
     impostor_count = max(20, len(X_test) * 2)
 
     # Query more users for better impostor representation
-    other_users = User.query.filter(User.id != user_id).limit(20).all()
-    X_impostor_list = []
-
-    for other_user in other_users:
-        # Get test samples from this other user to use as impostors
-        samples = KeystrokeData.query.filter_by(
-            user_id=other_user.id,
-            data_split='test'
-        ).limit(impostor_count // len(other_users) + 1).all()
-
-        for s in samples:
-            if len(X_impostor_list) >= impostor_count:
-                break
-            feat_dict = json.loads(s.keystroke_features)
-            fv = extract_features(feat_dict)
-            if fv:
-                X_impostor_list.append(fv)
-
-        if len(X_impostor_list) >= impostor_count:
-            break
-
-    # Convert to numpy array
-    if len(X_impostor_list) < 5:
+    # Only the ids are needed, so skip loading full User rows
+    other_user_ids = [uid for (uid,) in db.session.query(User.id).filter(User.id != user_id).order_by(User.id).limit(20)]
+
+    # Test samples from those users, an even share each, as impostors
+    X_impostor = _feature_matrix(_impostor_feature_rows(
+        other_user_ids, 'test',
+        per_user=impostor_count // max(len(other_user_ids), 1) + 1,
+        total=impostor_count,
+    ))
+
+    if len(X_impostor) < 5:
         # Fallback: not enough other users, use simulated
         print(f"WARNING: Not enough impostor data for user {user_id}, using simulation")
-        X_impostor = np.random.normal(X_test.mean(axis=0), X_test.std(axis=0), (impostor_count, X_test.shape[1]))
-    else:
-        X_impostor = np.array(X_impostor_list[:impostor_count], dtype=np.float32)
+        X_impostor = rng.normal(X_test.mean(axis=0), X_test.std(axis=0), (impostor_count, X_test.shape[1]))
 
     # Test on impostor samples
     raw_impostor = model.predict(X_impostor)
@@ -116,12 +211,13 @@ def compute_metrics(model, X_test, X_train, user_id):
 # ======================================================================
 #  TRAIN USER MODEL (Uses data_split if available)
 # ======================================================================
-def train_user_model(user_id):
+def train_user_model(user_id, tree_jobs=-1):
     """
     Train machine learning models for a specific user's keystroke biometrics.
 
     Args:
         user_id (int): Database ID of the user to train models for
+        tree_jobs (int): n_jobs for the RandomForest and IsolationForest fits
 
     Returns:
         tuple: (result_dict, error_message)
@@ -148,32 +244,19 @@ def train_user_model(user_id):
     """
 
     # load samples using data_split field (for dataset users)
-    train_samples = KeystrokeData.query.filter_by(
-        user_id=user_id, data_split='train'
-    ).all()
+    train_samples = _user_feature_rows(user_id, data_split='train')
 
-    test_samples = KeystrokeData.query.filter_by(
-        user_id=user_id, data_split='test'
-    ).all()
+    test_samples = _user_feature_rows(user_id, data_split='test')
 
     # If no split data (e.g., Sharifa's live data), use all training data
     if not train_samples:
-        all_samples = KeystrokeData.query.filter_by(
-            user_id=user_id, is_training_data=True
-        ).all()
+        all_samples = _user_feature_rows(user_id, is_training_data=True)
 
         if len(all_samples) < 10:
             return None, f"User {user_id} needs at least 10 training samples."
 
         # Extract features from all samples
-        X = []
-        for s in all_samples:
-            feat_dict = json.loads(s.keystroke_features)
-            fv = extract_features(feat_dict)
-            if fv:
-                X.append(fv)
-
-        X = np.array(X, dtype=np.float32)
+        X = _feature_matrix(all_samples)
 
         if X.shape[0] < 10:
             return None, "Not enough valid feature vectors."
@@ -184,27 +267,14 @@ def train_user_model(user_id):
         )
     else:
         # Use pre-split data
-        X_train = []
-        for s in train_samples:
-            feat_dict = json.loads(s.keystroke_features)
-            fv = extract_features(feat_dict)
-            if fv:
-                X_train.append(fv)
-
-        X_train = np.array(X_train, dtype=np.float32)
+        X_train = _feature_matrix(train_samples)
 
         if len(X_train) < 10:
             return None, f"User {user_id} needs at least 10 training samples."
 
         # Use test split if available, otherwise use validation
         if test_samples:
-            X_test = []
-            for s in test_samples:
-                feat_dict = json.loads(s.keystroke_features)
-                fv = extract_features(feat_dict)
-                if fv:
-                    X_test.append(fv)
-            X_test = np.array(X_test, dtype=np.float32)
+            X_test = _feature_matrix(test_samples)
         else:
             # Fallback: use 30% of training data as test
             X_train, X_test = train_test_split(
@@ -214,12 +284,19 @@ def train_user_model(user_id):
 
     # NORMALIZE FEATURES (Critical for SVM, MLP, and better accuracy)
 
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
+    # A warm-started MLP keeps the scaler its weights were learned on; otherwise refit
+    warm_mlp, scaler = _warm_start_mlp(user_id, len(X_train) + len(X_test))
+    if scaler is None:
+        scaler = StandardScaler().fit(X_train)
+    X_train_scaled = scaler.transform(X_train)
     X_test_scaled = scaler.transform(X_test)
 
     results = []
 
+    # Per-call RNG: /ml/train-all trains users on parallel threads, so the
+    # process-global numpy RNG would make each run depend on thread timing
+    rng = np.random.RandomState(42)
+
     # Prepare impostor samples for supervised learning (RF, GB)
     
     X_train_impostor_list = []  # Initialize here to avoid undefined variable warnings
@@ -228,48 +305,37 @@ def train_user_model(user_id):
         impostor_train_count = len(X_train_scaled) // 2
 
         # Collect impostor training samples from other users
-        other_users_train = User.query.filter(User.id != user_id).limit(15).all()
-
-        for other_user in other_users_train:
-            samples = KeystrokeData.query.filter_by(
-                user_id=other_user.id,
-                data_split='train'
-            ).limit(impostor_train_count // len(other_users_train) + 1).all()
-
-            for s in samples:
-                if len(X_train_impostor_list) >= impostor_train_count:
-                    break
-                feat_dict = json.loads(s.keystroke_features)
-                fv = extract_features(feat_dict)
-                if fv:
-                    X_train_impostor_list.append(fv)
-
-            if len(X_train_impostor_list) >= impostor_train_count:
-                break
+        other_user_ids_train = [uid for (uid,) in db.session.query(User.id).filter(User.id != user_id).order_by(User.id).limit(15)]
+
+        X_train_impostor_list = _feature_matrix(_impostor_feature_rows(
+            other_user_ids_train, 'train',
+            per_user=impostor_train_count // max(len(other_user_ids_train), 1) + 1,
+            total=impostor_train_count,
+        ))
     except Exception as e:
         print(f"Error collecting impostor samples: {e}")
 
+    # Genuine + impostor training set shared by the supervised models, scaled once
+    X_sup_train = y_sup_train = None
+    if len(X_train_impostor_list) >= 10:
+        X_train_impostor_scaled = scaler.transform(np.asarray(X_train_impostor_list, dtype=np.float32))
+        X_sup_train = np.vstack([X_train_scaled, X_train_impostor_scaled])
+        y_sup_train = np.concatenate([
+            np.ones(len(X_train_scaled)),      # Genuine = 1
+            np.zeros(len(X_train_impostor_scaled))  # Impostor = 0
+        ])
+
    
     # RandomForest 
  
     try:
         # If we have enough impostor data, train RandomForest
-        if len(X_train_impostor_list) >= 10:
-            X_train_impostor = np.array(X_train_impostor_list, dtype=np.float32)
-            X_train_impostor_scaled = scaler.transform(X_train_impostor)
-
-            # Combine genuine + impostor for supervised learning
-            X_rf_train = np.vstack([X_train_scaled, X_train_impostor_scaled])
-            y_rf_train = np.concatenate([
-                np.ones(len(X_train_scaled)),      # Genuine = 1
-                np.zeros(len(X_train_impostor_scaled))  # Impostor = 0
-            ])
-
-            rf = RandomForestClassifier(n_estimators=300, max_depth=25, random_state=42)
-            rf.fit(X_rf_train, y_rf_train)
+        if X_sup_train is not None:
+            rf = RandomForestClassifier(n_estimators=300, max_depth=25, random_state=42, n_jobs=tree_jobs)
+            rf.fit(X_sup_train, y_sup_train)
 
             # Evaluate (compute_metrics will handle test impostor samples)
-            acc, far, frr, mat = compute_metrics(rf, X_test_scaled, X_train_scaled, user_id)
+            acc, far, frr, mat = compute_metrics(rf, X_test_scaled, X_train_scaled, user_id, rng)
             results.append(("RandomForest", rf, acc, far, frr, mat))
             print(f"✓ RandomForest trained: Acc={acc:.4f}, FAR={far:.4f}, FRR={frr:.4f}")
         else:
@@ -278,23 +344,17 @@ def train_user_model(user_id):
         print(f"RandomForest ERROR: {e}")
 
     
-    # GradientBoosting (supervised learning)
+    # GradientBoosting (supervised learning, histogram-binned features)
     try:
-        # Reuse impostor samples from RandomForest if available
-        if len(X_train_impostor_list) >= 10:
-            X_train_impostor = np.array(X_train_impostor_list, dtype=np.float32)
-            X_train_impostor_scaled = scaler.transform(X_train_impostor)
-
-            X_gb_train = np.vstack([X_train_scaled, X_train_impostor_scaled])
-            y_gb_train = np.concatenate([
-                np.ones(len(X_train_scaled)),
-                np.zeros(len(X_train_impostor_scaled))
-            ])
-
-            gb = GradientBoostingClassifier(random_state=42)
-            gb.fit(X_gb_train, y_gb_train)
+        # Reuse the supervised set built for RandomForest
+        if X_sup_train is not None:
+            gb = HistGradientBoostingClassifier(
+                max_iter=200, learning_rate=0.1, max_depth=None, random_state=42,
+                early_stopping=True, validation_fraction=0.1
+            )
+            gb.fit(X_sup_train, y_sup_train)
 
-            acc, far, frr, mat = compute_metrics(gb, X_test_scaled, X_train_scaled, user_id)
+            acc, far, frr, mat = compute_metrics(gb, X_test_scaled, X_train_scaled, user_id, rng)
             results.append(("GradientBoosting", gb, acc, far, frr, mat))
             print(f"✓ GradientBoosting trained: Acc={acc:.4f}, FAR={far:.4f}, FRR={frr:.4f}")
         else:
@@ -308,7 +368,7 @@ def train_user_model(user_id):
     try:
         svm = OneClassSVM(kernel="rbf", gamma="scale", nu=0.15)
         svm.fit(X_train_scaled)
-        acc, far, frr, mat = compute_metrics(svm, X_test_scaled, X_train_scaled, user_id)
+        acc, far, frr, mat = compute_metrics(svm, X_test_scaled, X_train_scaled, user_id, rng)
 
         results.append(("OneClassSVM", svm, acc, far, frr, mat))
         print(f"✓ OneClassSVM trained: Acc={acc:.4f}, FAR={far:.4f}, FRR={frr:.4f}")
@@ -322,10 +382,11 @@ def train_user_model(user_id):
         iso = IsolationForest(
             contamination=0.10,
             n_estimators=300,
-            random_state=42
+            random_state=42,
+            n_jobs=tree_jobs
         )
         iso.fit(X_train_scaled)
-        acc, far, frr, mat = compute_metrics(iso, X_test_scaled, X_train_scaled, user_id)
+        acc, far, frr, mat = compute_metrics(iso, X_test_scaled, X_train_scaled, user_id, rng)
 
         results.append(("IsolationForest", iso, acc, far, frr, mat))
         print(f"✓ IsolationForest trained: Acc={acc:.4f}, FAR={far:.4f}, FRR={frr:.4f}")
@@ -336,26 +397,28 @@ def train_user_model(user_id):
 
     try:
         # Generate simulated impostor samples for training
-        np.random.seed(42)
         impostor_count = len(X_train_scaled) // 2
-        indices = np.random.choice(len(X_train_scaled), size=impostor_count, replace=False)
+        indices = rng.choice(len(X_train_scaled), size=impostor_count, replace=False)
         X_train_impostor = X_train_scaled[indices].copy()
-        X_train_impostor += np.random.normal(0, 0.8, X_train_impostor.shape)
-        X_train_impostor *= np.random.uniform(0.7, 1.3, X_train_impostor.shape)
+        X_train_impostor += rng.normal(0, 0.8, X_train_impostor.shape)
+        X_train_impostor *= rng.uniform(0.7, 1.3, X_train_impostor.shape)
 
         # Combine genuine + impostor
         X_train_combined = np.vstack([X_train_scaled, X_train_impostor])
         y_train_combined = np.concatenate([np.ones(len(X_train_scaled)), np.zeros(len(X_train_impostor))])
 
-        mlp = MLPClassifier(
-            hidden_layer_sizes=(64, 32, 16),
-            max_iter=800,
-            random_state=42
-        )
+        # Continue from the previous MLP when only a few samples were added
+        mlp = warm_mlp
+        if mlp is None:
+            mlp = MLPClassifier(
+                hidden_layer_sizes=MLP_LAYERS,
+                max_iter=800,
+                random_state=42
+            )
         mlp.fit(X_train_combined, y_train_combined)
 
         # Evaluate using compute_metrics
-        acc, far, frr, mat = compute_metrics(mlp, X_test_scaled, X_train_scaled, user_id)
+        acc, far, frr, mat = compute_metrics(mlp, X_test_scaled, X_train_scaled, user_id, rng)
 
         results.append(("MLPClassifier", mlp, acc, far, frr, mat))
         print(f"✓ MLPClassifier trained: Acc={acc:.4f}, FAR={far:.4f}, FRR={frr:.4f}")
@@ -371,8 +434,8 @@ def train_user_model(user_id):
 
     version = f"{best_name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
 
-    # Deactivate old models
-    MLModel.query.filter_by(user_id=user_id, is_active=True).update({"is_active": False})
+    # Deactivate old models; their files are removed once the new one is committed
+    retired = retire_active_models(user_id)
 
     # Calculate total samples used
     total_samples = len(X_train) + len(X_test)
@@ -390,16 +453,18 @@ def train_user_model(user_id):
             "selected": model_name == best_name
         })
 
-    # Store new model WITH scaler (critical for inference)
-    model_package = {
-        'model': best_model,
-        'scaler': scaler  # Store scaler for consistent preprocessing during authentication
-    }
+    # Single-sample login predictions are faster without a thread pool
+    if "n_jobs" in best_model.get_params():
+        best_model.set_params(n_jobs=None)
+
+    # Store new model WITH scaler (critical for inference), each in its own file
+    model_data, scaler_data = save_model_package(user_id, version, best_model, scaler)
 
     saved = MLModel(
         user_id=user_id,
         model_version=version,
-        model_data=pickle.dumps(model_package),  # Store both model and scaler
+        model_data=model_data,
+        scaler_data=scaler_data,  # Scaler for consistent preprocessing during authentication
         training_data_count=total_samples,
         accuracy=best_acc,
         far=best_far,
@@ -426,6 +491,7 @@ def train_user_model(user_id):
 
     db.session.add(saved)
     db.session.commit()
+    delete_model_files(retired)
 
     return {
         "user_id": user_id,
@@ -449,13 +515,26 @@ def api_train_single(user_id):
     return jsonify({"success": True, "result": result}), 200
 
 
+def _train_in_app_context(app, user_id, tree_jobs):
+    """Run train_user_model in a worker thread with its own app context and session."""
+    with app.app_context():
+        return train_user_model(user_id, tree_jobs=tree_jobs)
+
+
 @ml_bp.route("/ml/train-all", methods=["POST"])
 def api_train_all():
-    users = User.query.all()
+    user_ids = [uid for (uid,) in db.session.query(User.id)]
     summary = []
 
-    for u in users:
-        result, err = train_user_model(u.id)
+    # Users train concurrently; sklearn fits release the GIL for most of the work
+    # Split the cores between users and trees so the two levels don't oversubscribe
+    app = current_app._get_current_object()
+    tree_jobs = max(1, cpu_count() // max(1, len(user_ids)))
+    outcomes = Parallel(n_jobs=TRAIN_ALL_JOBS, prefer="threads")(
+        delayed(_train_in_app_context)(app, uid, tree_jobs) for uid in user_ids
+    )
+
+    for result, err in outcomes:
         if result:
             summary.append(result)
 
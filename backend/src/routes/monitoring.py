@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
-from src.models.user import db, User, KeystrokeData, AuthenticationLog, SecurityAlert, MLModel
+from src.models.user import db, User, KeystrokeData, AuthenticationLog, SecurityAlert, MLModel, decode_keystroke_features
 from datetime import datetime, timedelta
-import json
+from sqlalchemy import case, func
 
 monitoring_bp = Blueprint("monitoring", __name__)
 
@@ -17,19 +17,20 @@ def get_recent_logins():
         
         since = datetime.utcnow() - timedelta(hours=hours)
         
-        logs = AuthenticationLog.query.filter(
+        rows = db.session.query(AuthenticationLog, User.email).outerjoin(
+            User, User.id == AuthenticationLog.user_id
+        ).filter(
             AuthenticationLog.timestamp >= since
         ).order_by(
             AuthenticationLog.timestamp.desc()
         ).limit(limit).all()
         
         data = []
-        for log in logs:
-            user = User.query.get(log.user_id)
+        for log, email in rows:
             data.append({
                 "id": log.id,
                 "user_id": log.user_id,
-                "user_email": user.email if user else "Unknown",
+                "user_email": email or "Unknown",
                 "timestamp": log.timestamp.isoformat(),
                 "result": log.result,
                 "confidence_score": log.confidence_score,
@@ -58,47 +59,29 @@ def get_user_metrics(user_id):
         hours = int(request.args.get("hours", 24))
         since = datetime.utcnow() - timedelta(hours=hours)
         
-        # Authentication attempts
-        total_attempts = AuthenticationLog.query.filter(
+        # Authentication attempts and average confidence in one pass
+        total_attempts, successful, failed, avg_confidence = db.session.query(
+            func.count(AuthenticationLog.id),
+            func.sum(case((AuthenticationLog.result == "success", 1), else_=0)),
+            func.sum(case((AuthenticationLog.result == "failed", 1), else_=0)),
+            func.avg(AuthenticationLog.confidence_score)
+        ).filter(
             AuthenticationLog.user_id == user_id,
             AuthenticationLog.timestamp >= since
-        ).count()
-        
-        successful = AuthenticationLog.query.filter(
-            AuthenticationLog.user_id == user_id,
-            AuthenticationLog.timestamp >= since,
-            AuthenticationLog.result == "success"
-        ).count()
-        
-        failed = AuthenticationLog.query.filter(
-            AuthenticationLog.user_id == user_id,
-            AuthenticationLog.timestamp >= since,
-            AuthenticationLog.result == "failed"
-        ).count()
-        
-        # Keystroke samples
-        keystroke_samples = KeystrokeData.query.filter(
+        ).one()
+        successful = successful or 0
+        failed = failed or 0
+        avg_confidence = avg_confidence or 0.0
+        
+        # Keystroke samples and anomalies
+        keystroke_samples, anomalies = db.session.query(
+            func.count(KeystrokeData.id),
+            func.sum(case((KeystrokeData.anomaly_score > 0.7, 1), else_=0))
+        ).filter(
             KeystrokeData.user_id == user_id,
             KeystrokeData.timestamp >= since
-        ).count()
-        
-        # Average confidence
-        logs_with_confidence = AuthenticationLog.query.filter(
-            AuthenticationLog.user_id == user_id,
-            AuthenticationLog.timestamp >= since,
-            AuthenticationLog.confidence_score.isnot(None)
-        ).all()
-        
-        avg_confidence = 0.0
-        if logs_with_confidence:
-            avg_confidence = sum(log.confidence_score for log in logs_with_confidence) / len(logs_with_confidence)
-        
-        # Anomalies
-        anomalies = KeystrokeData.query.filter(
-            KeystrokeData.user_id == user_id,
-            KeystrokeData.timestamp >= since,
-            KeystrokeData.anomaly_score > 0.7
-        ).count()
+        ).one()
+        anomalies = anomalies or 0
         
         # ML Model info
         ml_model = MLModel.query.filter_by(user_id=user_id, is_active=True).first()
@@ -146,7 +129,7 @@ def get_keystroke_stream(user_id):
         data = []
         for ks in keystroke_data:
             try:
-                features = json.loads(ks.keystroke_features) if ks.keystroke_features else {}
+                features = decode_keystroke_features(ks.keystroke_features)
             except:
                 features = {}
             
@@ -192,7 +175,7 @@ def get_alerts_stream():
         
         data = []
         for alert in alerts:
-            user = User.query.get(alert.user_id) if alert.user_id else None
+            user = alert.user if alert.user_id else None  # selectin-loaded with the alerts
             data.append({
                 "id": alert.id,
                 "user_id": alert.user_id,
@@ -7,6 +7,7 @@
 
 from flask import Blueprint, request, jsonify
 from src.models.user import db, SystemSettings
+from src.utils.settings_cache import clear_threshold_cache
 from datetime import datetime
 
 settings_bp = Blueprint('settings', __name__)
@@ -68,6 +69,7 @@ def initialize_default_settings():
                 updated_by="System"
             ))
     db.session.commit()
+    clear_threshold_cache()
 
 
 # ================================================================
@@ -146,6 +148,7 @@ def update_setting(key):
             setting.updated_by = updated_by
 
         db.session.commit()
+        clear_threshold_cache()
 
         return jsonify({"message": "Updated", "setting": setting.to_dict()})
 
@@ -188,6 +191,7 @@ def bulk_update():
             changed.append(key)
 
         db.session.commit()
+        clear_threshold_cache()
 
         return jsonify({"message": "Bulk update complete", "updated": changed})
 
@@ -203,6 +207,7 @@ def reset_settings():
     try:
         SystemSettings.query.delete()
         db.session.commit()
+        clear_threshold_cache()
         initialize_default_settings()
         return jsonify({"message": "All settings reset to defaults"})
     except Exception as e:
@@ -254,6 +259,7 @@ def import_settings():
                 setting.updated_by = updated_by
 
         db.session.commit()
+        clear_threshold_cache()
 
         return jsonify({"message": "Import complete"})
 
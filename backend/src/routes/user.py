@@ -10,6 +10,7 @@ from src.models.user import (
 )
 from datetime import datetime, timedelta
 from sqlalchemy import or_
+from src.utils.model_cache import delete_model_files, retire_active_models
 
 
 
@@ -335,9 +336,10 @@ def reset_auth(user_id):
         })
 
         # Deactivate all ML models
-        MLModel.query.filter_by(user_id=user_id).update({"is_active": False})
+        retired = retire_active_models(user_id)
 
         db.session.commit()
+        delete_model_files(retired)
 
         return jsonify({"message": "Authentication reset", "user": user.to_dict()})
 
@@ -11,6 +11,7 @@ from src.models.user import (
     KeystrokeData,
     MLModel
 )
+from src.utils.model_cache import delete_model_files, retire_active_models
 
 user_bp = Blueprint("user", __name__)
 
@@ -302,11 +303,10 @@ def reset_user_auth(user_id):
             {"is_training_data": False}
         )
 
-        MLModel.query.filter_by(user_id=user_id).update(
-            {"is_active": False}
-        )
+        retired = retire_active_models(user_id)
 
         db.session.commit()
+        delete_model_files(retired)
 
         return jsonify({"message": "Auth profile reset", "user": user.to_dict()})
 
@@ -15,34 +15,49 @@ import numpy as np
 
 
 # ======================================================================
-#  SAFE STATISTICAL HELPERS
+#  NUMERIC KERNEL
+#
+# Plain numpy over preallocated output, kept apart from the dict handling
+# in extract_features(). Writes into a float64 vector owned by the caller.
 # ======================================================================
 
-def _safe_mean(arr):
-    return float(np.mean(arr)) if len(arr) else 0.0
-
-def _safe_std(arr):
-    return float(np.std(arr)) if len(arr) > 1 else 0.0
-
-def _safe_median(arr):
-    return float(np.median(arr)) if len(arr) else 0.0
-
-def _safe_min(arr):
-    return float(np.min(arr)) if len(arr) else 0.0
-
-def _safe_max(arr):
-    return float(np.max(arr)) if len(arr) else 0.0
-
-def _safe_percentile(arr, p):
-    """
-    Calculate percentile using linear interpolation for more accurate timing metrics.
-    Uses 'linear' interpolation method (default in numpy) for smooth percentile estimation.
-    """
-    if len(arr) == 0:
-        return 0.0
-    # Use linear interpolation for more precise percentile calculation
-    # This is especially important for timing data where precision matters
-    return float(np.percentile(arr, p, interpolation='linear'))
+def _timing_stats(arr, out, i):
+    """Write mean, std, median, min, max, p25, p75 of arr into out[i:i + 7]."""
+    n = len(arr)
+    if n == 0:
+        out[i:i + 7] = 0.0
+        return
+    out[i] = np.mean(arr)
+    out[i + 1] = np.std(arr) if n > 1 else 0.0
+    out[i + 2] = np.median(arr)
+    out[i + 3] = np.min(arr)
+    out[i + 4] = np.max(arr)
+    # Linear interpolation (numpy's default) for precise timing percentiles
+    q = np.percentile(arr, np.array([25.0, 75.0]))
+    out[i + 5] = q[0]
+    out[i + 6] = q[1]
+
+
+def _extract_kernel(dwell, flight, pauses, speed, out):
+    # 1–8 dwell statistics, 9–16 flight statistics
+    _timing_stats(dwell, out, 0)
+    out[7] = len(dwell)
+    _timing_stats(flight, out, 8)
+    out[15] = len(flight)
+
+    # 17–19 pause / rhythm
+    out[16] = np.mean(pauses) if len(pauses) else 0.0
+    out[17] = np.std(pauses) if len(pauses) > 1 else 0.0
+    out[18] = len(pauses)
+
+    # 20–21 typing speed and session variability (coefficient of variation)
+    out[19] = speed
+    if len(dwell) and len(flight):
+        # Prevent division by zero with epsilon value
+        denominator = max(out[0] + out[8], 1e-9)
+        out[20] = (out[1] + out[9]) / denominator
+    else:
+        out[20] = 0.0
 
 
 # ======================================================================
@@ -58,7 +73,10 @@ def _safe_percentile(arr, p):
 #   20–21 → Typing Speed & Session Variability
 # ======================================================================
 
-def extract_features(ks):
+N_FEATURES = 21
+
+
+def extract_features(ks, out=None):
     """
     Given raw keystroke dict:
         {
@@ -69,75 +87,31 @@ def extract_features(ks):
             "hold_intervals": [...] (optional future)
         }
     Returns:
-        21-feature numeric vector
+        21-feature numeric vector. When `out` (a length-21 ndarray) is
+        given, it is filled in place and returned instead of a new list.
     """
 
-    dwell = ks.get("dwell_times", [])
-    flight = ks.get("flight_times", [])
-    pauses = ks.get("pause_patterns", [])
-    typing_speed = ks.get("typing_speed", 0)
-
-    # ===============================================================
-    # 1️⃣ DWELL-TIME FEATURES (8)
-    # ===============================================================
-    dwell_mean = _safe_mean(dwell)
-    dwell_std = _safe_std(dwell)
-    dwell_med = _safe_median(dwell)
-    dwell_min = _safe_min(dwell)
-    dwell_max = _safe_max(dwell)
-    dwell_p25 = _safe_percentile(dwell, 25)
-    dwell_p75 = _safe_percentile(dwell, 75)
-    dwell_count = float(len(dwell))
-
-    # ===============================================================
-    # 2️⃣ FLIGHT-TIME FEATURES (8)
-    # ===============================================================
-    flight_mean = _safe_mean(flight)
-    flight_std = _safe_std(flight)
-    flight_med = _safe_median(flight)
-    flight_min = _safe_min(flight)
-    flight_max = _safe_max(flight)
-    flight_p25 = _safe_percentile(flight, 25)
-    flight_p75 = _safe_percentile(flight, 75)
-    flight_count = float(len(flight))
-
-    # ===============================================================
-    # 3️⃣ PAUSE / RHYTHM FEATURES (3)
-    # ===============================================================
-    pauses_mean = _safe_mean(pauses)
-    pauses_std = _safe_std(pauses)
-    pauses_count = float(len(pauses))
-
-    # ===============================================================
-    # 4️⃣ HIGH-LEVEL TYPING BEHAVIOR (2)
-    # ===============================================================
-    speed = float(typing_speed)
-
-    # Global session variability → how chaotic or stable the pattern is
-    # Uses coefficient of variation (CV) for normalized timing stability measurement
-    if len(dwell) and len(flight):
-        dwell_std = _safe_std(dwell)
-        flight_std = _safe_std(flight)
-        dwell_mean = _safe_mean(dwell)
-        flight_mean = _safe_mean(flight)
+    dwell = np.asarray(ks.get("dwell_times", []), dtype=np.float64)
+    flight = np.asarray(ks.get("flight_times", []), dtype=np.float64)
+    pauses = np.asarray(ks.get("pause_patterns", []), dtype=np.float64)
+    typing_speed = float(ks.get("typing_speed", 0))
 
-        # Prevent division by zero with epsilon value
-        denominator = max(dwell_mean + flight_mean, 1e-9)
-        variability = float((dwell_std + flight_std) / denominator)
-    else:
-        variability = 0.0
-
-    # ===============================================================
-    # FINAL 21-FEATURE VECTOR
-    # ===============================================================
-    return [
-        dwell_mean, dwell_std, dwell_med, dwell_min,
-        dwell_max, dwell_p25, dwell_p75, dwell_count,
+    vector = np.empty(N_FEATURES, dtype=np.float64)
+    _extract_kernel(dwell, flight, pauses, typing_speed, vector)
 
-        flight_mean, flight_std, flight_med, flight_min,
-        flight_max, flight_p25, flight_p75, flight_count,
+    if out is None:
+        return vector.tolist()
+    out[:] = vector
+    return out
 
-        pauses_mean, pauses_std, pauses_count,
 
-        speed, variability
-    ]
+def feature_vector_bytes(ks):
+    """
+    extract_features() packed as N_FEATURES float32 values, the format of
+    KeystrokeData.feature_vector. Returns None when the sample can't be
+    extracted; training then falls back to the raw keystroke_features.
+    """
+    try:
+        return extract_features(ks, out=np.empty(N_FEATURES, dtype=np.float32)).tobytes()
+    except (AttributeError, TypeError, ValueError):
+        return None
@@ -0,0 +1,24 @@
+# ======================================================================
+#  BioAuthAI — orjson-backed Flask JSON provider
+#
+# Drop-in replacement for Flask's default provider so every jsonify()
+# response (dashboards, alert lists, per-user metrics) is encoded by
+# orjson. Output matches the default provider: sorted keys, compact
+# unless debugging, and dates/Decimals/UUIDs go through Flask's fallback.
+# ======================================================================
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Datetimes are passed through to Flask's default() so they keep the HTTP-date format
+    option = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS |
+              orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY)
+
+    def dumps(self, obj, **kwargs):
+        option = self.option | orjson.OPT_INDENT_2 if kwargs.get("indent") else self.option
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
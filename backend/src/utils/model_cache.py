@@ -0,0 +1,178 @@
+# ======================================================================
+#  BioAuthAI — IN-PROCESS MODEL CACHE
+#
+# Unpickling a stored sklearn model + scaler costs far more than the one
+# prediction made with it, so each trained model is deserialized once per
+# process and reused across logins and analyze calls.
+#
+# Entries are keyed by (MLModel.id, model_version): retraining stores a new
+# row with a new version, so a stale model can never be served and old
+# entries simply age out of the LRU.
+#
+# Login predictions are cached the same way for a short TTL, keyed by the
+# quantized feature vector, so a retried login with the same typing does
+# not run sklearn again.
+#
+# New models are written to disk with joblib (uncompressed) and only the
+# file references are kept in MLModel.model_data / scaler_data, so loading
+# memory-maps the estimator arrays instead of unpickling a copy out of the
+# database blob. Model and scaler live in separate files and load
+# independently. The scaler is only a few arrays, so it is kept as a plain
+# .npz and rebuilt without the unpickler. Rows saved before this change
+# still hold the pickled package and are read as before.
+#
+# Every saved row gets its own files. When a model is retired (retrained
+# or reset), its files are deleted once that change is committed.
+# ======================================================================
+
+from collections import OrderedDict
+from functools import lru_cache
+import os
+import logging
+import pickle
+import threading
+import time
+import uuid
+
+import joblib
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+
+from src.models.user import db, MLModel
+
+MODEL_CACHE_SIZE = 128  # deserialized models kept per process
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MODEL_DIR = os.path.join(BACKEND_DIR, "database", "models")
+MODEL_FILE_PREFIX = b"joblib:"  # model_data marker for models stored on disk
+ARRAY_FILE_PREFIX = b"npz:"  # scaler_data marker for scalers stored as plain arrays
+SCALER_ARRAYS = ('mean_', 'var_', 'scale_', 'n_samples_seen_')
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_CACHE_SIZE = 10000
+PREDICTION_CACHE_TTL = 60  # seconds
+PREDICTION_CACHE_DECIMALS = 3  # features are timings in seconds: 1 ms buckets
+
+_predictions = OrderedDict()  # (model id, version, feature bytes) -> (expires_at, prediction, confidence)
+_predictions_lock = threading.Lock()
+
+
+def _dump(obj, filename):
+    joblib.dump(obj, os.path.join(MODEL_DIR, filename), compress=0)
+    return MODEL_FILE_PREFIX + filename.encode()
+
+
+def _dump_scaler(scaler, filename):
+    np.savez(os.path.join(MODEL_DIR, filename), **{name: getattr(scaler, name) for name in SCALER_ARRAYS})
+    return ARRAY_FILE_PREFIX + filename.encode()
+
+
+def _load_scaler(filename):
+    """Rebuild a fitted StandardScaler from its arrays; no pickle involved."""
+    with np.load(os.path.join(MODEL_DIR, filename), allow_pickle=False) as arrays:
+        scaler = StandardScaler()
+        for name in SCALER_ARRAYS:
+            value = arrays[name]
+            setattr(scaler, name, value if value.ndim else value.item())
+    scaler.n_features_in_ = len(scaler.mean_)
+    return scaler
+
+
+def _load(data):
+    """Load one stored object: an npz scaler, a joblib file reference or a legacy pickle blob."""
+    if data.startswith(ARRAY_FILE_PREFIX):
+        return _load_scaler(data[len(ARRAY_FILE_PREFIX):].decode())
+    if data.startswith(MODEL_FILE_PREFIX):
+        filename = data[len(MODEL_FILE_PREFIX):].decode()
+        return joblib.load(os.path.join(MODEL_DIR, filename), mmap_mode='r')
+    return pickle.loads(data)  # stored before models moved to disk
+
+
+def save_model_package(user_id, model_version, model, scaler):
+    """Write model and scaler to MODEL_DIR as separate files.
+
+    Returns the (model_data, scaler_data) values to store on the MLModel row.
+    """
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    # Versions only have one-second resolution; the suffix keeps each row's files apart
+    stem = f"user_{user_id}_v{model_version}_{uuid.uuid4().hex[:12]}"
+    return _dump(model, f"{stem}.joblib"), _dump_scaler(scaler, f"{stem}.scaler.npz")
+
+
+def retire_active_models(user_id):
+    """Deactivate a user's active MLModel rows.
+
+    Returns their (model_data, scaler_data) references; pass them to
+    delete_model_files() after the deactivation is committed.
+    """
+    active = MLModel.query.filter_by(user_id=user_id, is_active=True)
+    refs = active.with_entities(MLModel.model_data, MLModel.scaler_data).all()
+    active.update({"is_active": False})
+    return refs
+
+
+def delete_model_files(refs):
+    """Remove the files behind retired models; legacy pickled rows have none."""
+    for model_data, scaler_data in refs:
+        for data, prefix in ((model_data, MODEL_FILE_PREFIX), (scaler_data, ARRAY_FILE_PREFIX)):
+            if not data or not data.startswith(prefix):
+                continue
+            try:
+                os.remove(os.path.join(MODEL_DIR, data[len(prefix):].decode()))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # e.g. still memory-mapped by this process on Windows; harmless to leave
+                logger.warning("Could not remove retired model file %r", data)
+
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def load_model_package(model_id, model_version):
+    """Return (model, scaler) for a stored MLModel; scaler is None for old models."""
+    model_data, scaler_data = (
+        db.session.query(MLModel.model_data, MLModel.scaler_data).filter_by(id=model_id).one()
+    )
+    model_package = _load(model_data)
+
+    # Older rows keep model + scaler together in one dict, or just the model
+    if isinstance(model_package, dict):
+        return model_package['model'], model_package.get('scaler', None)
+    return model_package, _load(scaler_data) if scaler_data else None
+
+
+def predict_with_cache(model_id, model_version, features):
+    """Return (prediction, confidence) for a 21-feature vector, reusing recent results."""
+    key = (model_id, model_version, np.round(features, PREDICTION_CACHE_DECIMALS).tobytes())
+    now = time.monotonic()
+
+    with _predictions_lock:
+        hit = _predictions.get(key)
+        if hit and hit[0] > now:
+            _predictions.move_to_end(key)
+            return hit[1], hit[2]
+
+    model, scaler = load_model_package(model_id, model_version)
+    X = features.reshape(1, -1)
+
+    # Apply scaling if scaler is available (new models)
+    if scaler is not None:
+        X = scaler.transform(X)
+
+    if hasattr(model, 'predict_proba'):
+        # One pass: predict() would recompute the same probabilities to argmax them
+        proba = model.predict_proba(X)[0]
+        prediction = model.classes_[np.argmax(proba)]
+        confidence = float(proba[-1])
+    else:
+        # OneClassSVM / IsolationForest only predict +1 / -1
+        prediction = model.predict(X)[0]
+        confidence = 0.95 if prediction == 1 else 0.15
+
+    with _predictions_lock:
+        _predictions[key] = (now + PREDICTION_CACHE_TTL, prediction, confidence)
+        _predictions.move_to_end(key)
+        while len(_predictions) > PREDICTION_CACHE_SIZE:
+            _predictions.popitem(last=False)
+
+    return prediction, confidence
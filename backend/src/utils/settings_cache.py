@@ -0,0 +1,33 @@
+# ======================================================================
+#  BioAuthAI — SYSTEM SETTINGS CACHE
+#
+# Login reads its confidence thresholds from SystemSettings on every
+# request. Those rows change rarely, so each key's raw value is cached
+# per process for THRESHOLD_CACHE_TTL seconds. The settings routes call
+# clear_threshold_cache() after every write so a change applies at once
+# in this process; other workers pick it up when their entries expire.
+# ======================================================================
+
+import time
+
+from src.models.user import SystemSettings, db
+
+THRESHOLD_CACHE_TTL = 60  # seconds; settings writes clear the cache immediately
+_threshold_cache = {}  # setting key -> (expires_at, raw value or None)
+
+
+def get_threshold(key, default_value):
+    """Get threshold from SystemSettings or use default (cached for THRESHOLD_CACHE_TTL seconds)."""
+    now = time.monotonic()
+    entry = _threshold_cache.get(key)
+    if entry is None or entry[0] <= now:
+        value = db.session.query(SystemSettings.value).filter_by(key=key).scalar()
+        entry = _threshold_cache[key] = (now + THRESHOLD_CACHE_TTL, value)
+    if entry[1] is not None:
+        return float(entry[1])
+    return default_value
+
+
+def clear_threshold_cache():
+    """Drop cached thresholds; called by the settings routes after every write."""
+    _threshold_cache.clear()
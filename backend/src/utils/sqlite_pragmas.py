@@ -0,0 +1,23 @@
+# ======================================================================
+#  BioAuthAI — PER-CONNECTION SQLITE PRAGMAS (BULK WRITES + READ CACHE)
+#
+# journal_mode=WAL is stored in the database file, but these settings
+# only last for the connection that ran them, so every engine (the Flask
+# app's and the standalone one in src/database.py) applies them on connect.
+# ======================================================================
+
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL;",    # safe under WAL, no fsync per commit
+    "PRAGMA cache_size=-65536;",     # 64 MB page cache
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA mmap_size=268435456;",   # 256 MB memory-mapped reads
+    "PRAGMA busy_timeout=5000;",
+)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """'connect' event listener that runs SQLITE_PRAGMAS on a new connection."""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
@@ -0,0 +1,132 @@
+# ======================================================================
+#  BioAuthAI — BACKGROUND WRITE QUEUE
+#
+# Authentication logs, security alerts and analyze's anomaly scores have no
+# consistency requirement with the response, so their routes hand them to a
+# worker thread instead of writing them before they respond.
+#
+# The worker groups whatever arrives within WRITE_FLUSH_INTERVAL into one
+# commit. New rows are added as ORM objects (not bulk mappings) so the
+# AuthenticationLog listeners that maintain auth_stats_hourly still fire;
+# updates by primary key go out as one executemany UPDATE per model.
+# If a batch commit fails, its rows are retried one by one so a single bad
+# row can't take unrelated audit rows down with it. At interpreter exit
+# stop_worker() queues a sentinel and joins the worker, so the batch in
+# flight and everything queued before it are written.
+# ======================================================================
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app
+
+from src.models.user import db
+
+WRITE_FLUSH_INTERVAL = 0.1  # seconds a batch stays open
+WRITE_BATCH_SIZE = 500  # rows per commit at most
+
+logger = logging.getLogger(__name__)
+
+_pending = queue.Queue()  # (model class, row id or None for an insert, column values)
+_STOP = object()  # queued by stop_worker(); the worker exits once it reaches it
+_app = None
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def enqueue_insert(model, **values):
+    """Insert a model row in the background; call inside an app context."""
+    _ensure_worker()
+    _pending.put((model, None, values))
+
+
+def enqueue_update(model, row_id, **values):
+    """Update columns of one row by primary key in the background; call inside an app context."""
+    _ensure_worker()
+    _pending.put((model, row_id, values))
+
+
+def stop_worker():
+    """Write everything queued so far, then stop the worker thread."""
+    if _worker is None or not _worker.is_alive():
+        return
+    _pending.put(_STOP)
+    _worker.join()
+
+
+def _ensure_worker():
+    global _app, _worker
+    if _worker is not None:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _app = current_app._get_current_object()
+            # Daemon so a missed stop can't hang exit; stop_worker() joins it at exit
+            _worker = threading.Thread(target=_run, name="write-queue", daemon=True)
+            _worker.start()
+            atexit.register(stop_worker)
+
+
+def _run():
+    while True:
+        item = _pending.get()
+        if item is _STOP:
+            return
+        batch = [item]
+        stopping = False
+        deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+        while len(batch) < WRITE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        _write(batch)
+        if stopping:
+            return
+
+
+def _write(batch):
+    with _app.app_context():
+        try:
+            if not _commit(batch) and len(batch) > 1:
+                # Isolate the failing row(s) instead of dropping the whole batch
+                logger.warning("Batch of %d queued rows failed; retrying one by one", len(batch))
+                for item in batch:
+                    _commit([item])
+        finally:
+            db.session.remove()
+
+
+def _commit(batch):
+    """Write and commit batch; on failure roll back and return False."""
+    try:
+        _apply(batch)
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        if len(batch) == 1:
+            logger.exception("Dropped queued row %r", batch[0])
+        return False
+
+
+def _apply(batch):
+    updates = defaultdict(list)
+    for model, row_id, values in batch:
+        if row_id is None:
+            db.session.add(model(**values))
+        else:
+            updates[model].append(dict(values, id=row_id))
+    for model, mappings in updates.items():
+        db.session.bulk_update_mappings(model, mappings)